@@ -0,0 +1,126 @@
+import logging
+import re
+import time
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop
+from metrics import UPDATES_REJECTED
+from ratelimit import TokenBucket
+from rendering import locale_of, text
+
+logger = logging.getLogger(__name__)
+
+# Buttons that only show something; under load they are shed before anything that changes state
+READ_ONLY_CALLBACKS = re.compile(r"^(products|products_page_\d+|cart|profile|tips|pricing)$")
+# Repeated add-to-cart taps are meant: the cart buffer sums them into one call (+n)
+NOT_DEDUPLICATED = re.compile(r"^add_")
+
+def update_kind(update):
+    if update.callback_query:
+        return "callback"
+    if update.inline_query:
+        return "inline"
+    message = update.message
+    if message and message.text and message.text.startswith("/"):
+        return "command"
+    if message:
+        return "message"
+    return "other"
+
+class AdmissionControl:
+    """Turns away updates before they reach the handlers, cheapest to lose first.
+
+    Set shed() as PerUserUpdateProcessor.shed, so it sees each update as it
+    arrives, before it waits for its turn, and register admit() as a TypeHandler
+    in group -1; an update admit() rejects raises ApplicationHandlerStop so no
+    other handler sees it.
+
+    - Load shedding (shed): with more than `shed_at` updates received and not yet
+      running, inline queries and read-only callbacks are dropped; above
+      `shed_all_at` commands and all callbacks are dropped as well.
+    - Duplicates (admit): the same callback_data from the same user again within
+      `dedup_window` seconds is ignored (double taps, impatient re-presses).
+      Add-to-cart buttons are exempt, the cart buffer adds their repeats up.
+    - Per-user token bucket (admit): callbacks and commands beyond `rate` per
+      second, with bursts of `burst`, are refused.
+
+    Plain messages are never rejected, they carry conversation input (logins,
+    bucket ids, planting photos) that can't be asked for again. Rejected
+    callback queries are still answered, so the button stops spinning.
+    """
+
+    def __init__(self, rate=2, burst=10, dedup_window=1.0, shed_at=500, shed_all_at=1000):
+        self.rate = rate
+        self.burst = burst
+        self.dedup_window = dedup_window
+        self.shed_at = shed_at
+        self.shed_all_at = shed_all_at
+        # user id -> TokenBucket
+        self._buckets = {}
+        # (user id, callback_data) -> when it was last let through
+        self._pressed = {}
+
+    async def shed(self, update, backlog):
+        """Returns True if the update should be dropped with `backlog` updates waiting."""
+        if backlog <= self.shed_at or not isinstance(update, Update) or update.effective_user is None:
+            return False
+        kind = update_kind(update)
+        if kind in ("message", "other"):
+            return False
+        query = update.callback_query
+        cheap = kind == "inline" or (query is not None and READ_ONLY_CALLBACKS.match(query.data or ""))
+        if not (cheap or backlog > self.shed_all_at):
+            return False
+        await self._turn_away(update, "shed", kind, "busy")
+        return True
+
+    async def admit(self, update: Update, context):
+        if not isinstance(update, Update) or update.effective_user is None:
+            return
+        kind = update_kind(update)
+        if kind in ("message", "other"):
+            return
+        user_id = update.effective_user.id
+        query = update.callback_query
+
+        now = time.monotonic()
+        if query is not None and self.dedup_window > 0 and not NOT_DEDUPLICATED.match(query.data or ""):
+            key = (user_id, query.data)
+            if now - self._pressed.get(key, float("-inf")) < self.dedup_window:
+                await self._reject(update, "duplicate", kind)
+            self._remember(key, now)
+
+        if kind != "inline" and self._bucket(user_id).take() > 0:
+            await self._reject(update, "rate_limited", kind, "slow_down")
+
+    def _remember(self, key, now):
+        if len(self._pressed) > 10000:
+            # Forget presses that can no longer be duplicated
+            for k in [k for k, pressed in self._pressed.items() if now - pressed >= self.dedup_window]:
+                del self._pressed[k]
+        self._pressed[key] = now
+
+    def _bucket(self, user_id):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # Forget users who have been quiet long enough to refill
+                for key in [k for k, b in self._buckets.items() if b.idle()]:
+                    del self._buckets[key]
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def _reject(self, update, reason, kind, notice=None):
+        await self._turn_away(update, reason, kind, notice)
+        raise ApplicationHandlerStop
+
+    async def _turn_away(self, update, reason, kind, notice=None):
+        UPDATES_REJECTED.labels(reason, kind).inc()
+        logger.debug(f"Rejected {kind} from {update.effective_user.id}: {reason}")
+        query = update.callback_query
+        if query is not None:
+            try:
+                await query.answer(text(locale_of(update.effective_user), notice) if notice else None)
+            except TelegramError:
+                # The query may already be too old to answer when the bot is this busy
+                pass
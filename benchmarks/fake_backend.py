@@ -0,0 +1,95 @@
+"""In-process stand-in for the Novda Django backend (and Telegram file downloads).
+
+Plug FakeBackend.transport into ApiService to run the bot without a backend.
+"""
+import asyncio
+import base64
+import json
+import random
+import time
+from collections import Counter
+import httpx
+
+def fake_jwt(user, ttl=3600):
+    payload = base64.urlsafe_b64encode(json.dumps({"user": user, "exp": time.time() + ttl}).encode())
+    return f"e30.{payload.decode().rstrip('=')}.sig"
+
+def fake_products(count):
+    return [
+        {
+            "id": i,
+            "price": str(10 + i % 5 * 5),
+            "tree": {
+                "name_en": f"Tree {i}", "desc_en": f"A healthy sapling number {i}.",
+                "name_uz": f"Daraxt {i}", "desc_uz": f"{i}-raqamli ko'chat.",
+                "name_ru": f"Дерево {i}", "desc_ru": f"Саженец номер {i}.",
+            },
+        }
+        for i in range(1, count + 1)
+    ]
+
+def fake_buckets(count, lat=41.31, lon=69.28, spread=0.05):
+    """Ordered buckets scattered around a point (Tashkent by default)."""
+    return [
+        {"id": i, "latitude": lat + random.uniform(-spread, spread), "longitude": lon + random.uniform(-spread, spread),
+         "status": "pending"}
+        for i in range(1, count + 1)
+    ]
+
+class FakeBackend:
+    """Answers the endpoints ApiService calls.
+
+    `latency` is the mean response time in seconds (+/- `jitter`), `error_rate`
+    the share of requests answered with a 503.
+    """
+
+    def __init__(self, latency=0.02, jitter=0.01, error_rate=0.0, products=50, photo_size=150_000, buckets=10_000):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.products = fake_products(products)
+        self.buckets = fake_buckets(buckets)
+        self.photo = b"\xff\xd8" + b"\0" * (photo_size - 2)
+        self.calls = Counter()
+        self.carts = {}
+        self.transport = httpx.MockTransport(self.handle)
+
+    async def handle(self, request):
+        path = request.url.path
+        if request.url.host == "api.telegram.org":
+            self.calls["telegram_file"] += 1
+            return httpx.Response(200, content=self.photo)
+
+        self.calls[path] += 1
+        # Drain streamed bodies like a real server would
+        body = b"".join([chunk async for chunk in request.stream])
+        await asyncio.sleep(max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+        if self.error_rate and random.random() < self.error_rate:
+            return httpx.Response(503, text="injected error")
+
+        user = request.headers.get("Authorization", "")
+        if path in ("/api/login/", "/register/"):
+            return httpx.Response(200, json={"access": fake_jwt(body.decode()[:32])})
+        if path == "/api/products/":
+            return httpx.Response(200, json=self.products)
+        if path == "/api/addToCart/":
+            data = json.loads(body)
+            cart = self.carts.setdefault(user, Counter())
+            cart[int(data["product_id"])] += int(data.get("count", 1))
+            return httpx.Response(201, json={"ok": True})
+        if path == "/api/get/my/trees/":
+            cart = self.carts.get(user, {})
+            items = [{"id": pid, "count": n, "product": self.products[pid - 1]} for pid, n in cart.items()]
+            return httpx.Response(200, json=items)
+        if path == "/api/checkout/":
+            self.carts.pop(user, None)
+            return httpx.Response(201, json={"order": 1})
+        if path == "/api/get/me/":
+            return httpx.Response(200, json={"name": "Bench User", "region": "Tashkent", "phoneNumber": "+998900000000"})
+        if path == "/api/get/orders/":
+            return httpx.Response(200, json=self.buckets)
+        if path == "/api/plant/tree/":
+            return httpx.Response(201, json={"id": self.calls[path]})
+        if path in ("/logout/", "/api/update/cart/", "/api/remove/cart/"):
+            return httpx.Response(200, json={"ok": True})
+        return httpx.Response(404, json={"detail": "Not found."})
@@ -0,0 +1,155 @@
+"""Load test for the bot's handlers against a fake backend and a fake Telegram API.
+
+Usage (from the repo root):
+    python -m benchmarks.run --users 500 --actions 3 --latency 0.05 --error-rate 0.01
+
+Reports updates/sec, per-handler latency percentiles (time from enqueue until the
+update is fully handled) and memory use. Telegram flood limits are off by default
+since the fake Bot API has none; set TELEGRAM_RATE_LIMIT=1 to include the scheduler.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+# The bot reads its settings at import time, keep benchmark state away from real data
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="novda-bench-"))
+os.environ.setdefault("TOKEN_STORE", "memory")
+os.environ.setdefault("TELEGRAM_RATE_LIMIT", "0")
+# Each user's whole session is enqueued at once, which a real user never does
+os.environ.setdefault("MAX_PENDING_PER_USER", "1000")
+# and the whole run is enqueued up front
+os.environ.setdefault("MAX_QUEUED_UPDATES", "1000000")
+# Synthetic users press buttons far faster than people can, so admission control would turn
+# most of them away; set ADMISSION_CONTROL=1 to measure it anyway
+os.environ.setdefault("ADMISSION_CONTROL", "0")
+
+import logging
+from telegram import Update
+from telegram.ext import Application
+import bot
+import handlers
+from config import BOT_TOKEN, MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES, MAX_PENDING_PER_USER, MAX_QUEUED_UPDATES
+from dispatch import PerUserUpdateProcessor
+from metrics import UPDATES_REJECTED
+from benchmarks.fake_backend import FakeBackend
+from benchmarks.updates import FakeTelegramRequest, UpdateFactory
+
+class TimedUpdateProcessor(PerUserUpdateProcessor):
+    """Records how long each update took from being enqueued until it was handled."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.enqueued = {}
+        self.latencies = defaultdict(list)
+
+    async def do_process_update(self, update, coroutine):
+        try:
+            await super().do_process_update(update, coroutine)
+        finally:
+            kind, started = self.enqueued.pop(update.update_id)
+            self.latencies[kind].append(time.perf_counter() - started)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def interleave(sessions):
+    """Round-robin over users, keeping each user's own updates in order."""
+    sessions = [list(s) for s in sessions]
+    while sessions:
+        for s in sessions:
+            yield s.pop(0)
+        sessions = [s for s in sessions if s]
+
+async def run(args):
+    backend = FakeBackend(args.latency, args.jitter, args.error_rate, args.products)
+    handlers.api.transport = backend.transport
+    telegram = FakeTelegramRequest(args.tg_latency)
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(telegram)
+        .get_updates_request(FakeTelegramRequest())
+    )
+    processor = TimedUpdateProcessor(args.concurrency, MAX_PENDING_UPDATES, MAX_PENDING_PER_USER, MAX_QUEUED_UPDATES)
+    application = bot.build_application(builder, processor)
+
+    factory = UpdateFactory(args.products)
+    sessions = [factory.session(100_000 + i, args.actions) for i in range(args.users)]
+
+    await application.initialize()
+    await bot.post_init(application)
+    await application.start()
+
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    total = 0
+    for kind, payload in interleave(sessions):
+        update = Update.de_json(payload, application.bot)
+        processor.enqueued[update.update_id] = (kind, time.perf_counter())
+        await application.update_queue.put(update)
+        total += 1
+    await application.update_queue.join()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    # Let the outbox finish uploading plantings before shutting down
+    deadline = time.monotonic() + args.drain_timeout
+    while handlers.outbox.pending_count() and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    outbox_left = handlers.outbox.pending_count()
+
+    # Same order as Application.run_polling
+    await application.stop()
+    await application.shutdown()
+    await bot.post_shutdown(application)
+
+    print(f"\n{total} updates from {args.users} users in {elapsed:.2f}s: {total / elapsed:.0f} updates/sec")
+    print(f"dropped updates: {processor.dropped}, plantings left in outbox: {outbox_left}")
+    rejected = {
+        f"{sample.labels['reason']}/{sample.labels['kind']}": int(sample.value)
+        for metric in UPDATES_REJECTED.collect() for sample in metric.samples
+        if sample.name.endswith("_total") and sample.value
+    }
+    if rejected:
+        print("rejected by admission control: " + ", ".join(f"{k} {n}" for k, n in sorted(rejected.items())))
+    memory = f"max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB"
+    if args.trace_memory:
+        memory += f", peak traced during the run: {peak / 2**20:.1f} MiB"
+    print(memory + "\n")
+    print(f"{'handler':<28}{'count':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for kind, values in sorted(processor.latencies.items()):
+        print(f"{kind:<28}{len(values):>7}" + "".join(
+            f"{percentile(values, q) * 1000:>10.1f}" for q in (0.5, 0.9, 0.99, 1.0)
+        ))
+    print("\nbackend calls: " + ", ".join(f"{path} {n}" for path, n in sorted(backend.calls.items())))
+    print("telegram calls: " + ", ".join(f"{method} {n}" for method, n in sorted(telegram.calls.items())))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--actions", type=int, default=3, help="flows per user after signing in")
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="mean backend latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of backend calls failing with 503")
+    parser.add_argument("--tg-latency", type=float, default=0.0, help="latency of each Bot API call (s)")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_UPDATES)
+    parser.add_argument("--drain-timeout", type=float, default=10.0)
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="track allocations with tracemalloc (slows the run down several times)")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
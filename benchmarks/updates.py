@@ -0,0 +1,209 @@
+"""Synthetic Telegram traffic: Update payloads for the bot's flows and a fake Bot API."""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Novda Bench", "username": "novda_bench_bot"}
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers Bot API calls locally, with an optional per-call latency."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1_000_000)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint in ("sendMessage", "editMessageText"):
+            result = {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id"), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        elif endpoint == "getFile":
+            result = {"file_id": params["file_id"], "file_unique_id": params["file_id"], "file_size": 150_000,
+                      "file_path": f"photos/{params['file_id']}.jpg"}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+class UpdateFactory:
+    """Builds Update payloads (as dicts, see Update.de_json) for one synthetic user at a time."""
+
+    def __init__(self, products=50):
+        self.products = products
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}",
+                "language_code": random.choice(["en", "uz", "ru"])}
+
+    def _message(self, user_id, **fields):
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                **fields,
+            },
+        }
+
+    def text(self, user_id, text):
+        fields = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._message(user_id, **fields)
+
+    def location(self, user_id, lat=41.31, lon=69.28):
+        return self._message(user_id, location={"latitude": lat, "longitude": lon})
+
+    def photo(self, user_id, media_group_id=None):
+        file_id = f"photo{next(self._message_ids)}"
+        sizes = [(320, 240, 15_000), (800, 600, 60_000), (1280, 960, 150_000)]
+        fields = {"photo": [
+            {"file_id": f"{file_id}_{w}", "file_unique_id": f"{file_id}_{w}", "width": w, "height": h, "file_size": size}
+            for w, h, size in sizes
+        ]}
+        if media_group_id is not None:
+            fields["media_group_id"] = media_group_id
+        return self._message(user_id, **fields)
+
+    def callback(self, user_id, data):
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "menu",
+                },
+            },
+        }
+
+    def inline_query(self, user_id, query, offset=""):
+        return {
+            "update_id": next(self._update_ids),
+            "inline_query": {
+                "id": str(next(self._message_ids)),
+                "from": self._user(user_id),
+                "query": query,
+                "offset": offset,
+            },
+        }
+
+    # Each scenario returns a list of (kind, payload); kind labels the latency histogram
+
+    def login(self, user_id):
+        return [
+            ("conv:login:start", self.text(user_id, "/login")),
+            ("conv:login:username", self.text(user_id, f"user{user_id}")),
+            ("conv:login:password", self.text(user_id, "secret")),
+        ]
+
+    def register(self, user_id):
+        steps = ["username", "password", "firstname", "lastname", "phone", "region", "birthdate"]
+        answers = [f"user{user_id}", "secret", "Bench", "User", "+998900000000", "Tashkent", "1990-01-01"]
+        return [("conv:register:start", self.text(user_id, "/register"))] + [
+            (f"conv:register:{step}", self.text(user_id, answer)) for step, answer in zip(steps, answers)
+        ]
+
+    def browse(self, user_id):
+        product = random.randint(1, self.products)
+        return [
+            ("command:start", self.text(user_id, "/start")),
+            ("command:products", self.text(user_id, "/products")),
+            ("callback:products_page", self.callback(user_id, "products_page_1")),
+            ("callback:products_page", self.callback(user_id, "products_page_2")),
+            ("callback:add", self.callback(user_id, f"add_{product}")),
+            ("callback:add", self.callback(user_id, f"add_{product}")),
+            ("callback:add", self.callback(user_id, f"add_{random.randint(1, self.products)}")),
+            ("command:cart", self.text(user_id, "/cart")),
+            ("callback:checkout", self.callback(user_id, "checkout")),
+        ]
+
+    def search(self, user_id):
+        # An inline query per keystroke, then the next page of the last one
+        word = random.choice(["tree", "daraxt", "дерево", "sapling"])
+        number = str(random.randint(1, self.products))
+        queries = [word[:i] for i in range(1, len(word) + 1)] + [f"{word} {number[:i]}" for i in range(1, len(number) + 1)]
+        return [("inline:search", self.inline_query(user_id, q)) for q in queries] + [
+            ("inline:search", self.inline_query(user_id, queries[-1], offset="20")),
+        ]
+
+    def menu(self, user_id):
+        return [
+            ("callback:products", self.callback(user_id, "products")),
+            ("callback:profile", self.callback(user_id, "profile")),
+            ("callback:profile", self.callback(user_id, "profile")),
+            ("command:me", self.text(user_id, "/me")),
+            ("callback:tips", self.callback(user_id, "tips")),
+        ]
+
+    def plant(self, user_id):
+        if random.random() < 0.5:
+            # Location first, then a bucket from the nearby suggestions
+            return [
+                ("conv:plant:start", self.text(user_id, "/plant")),
+                ("conv:plant:nearby", self.location(user_id)),
+                ("conv:plant:pick", self.callback(user_id, f"plant_bucket_{random.randint(1, 10_000)}")),
+                ("conv:plant:photo", self.photo(user_id)),
+            ]
+        return [
+            ("conv:plant:start", self.text(user_id, "/plant")),
+            ("conv:plant:bucket", self.text(user_id, str(random.randint(1, 10_000)))),
+            ("conv:plant:location", self.location(user_id)),
+            ("conv:plant:photo", self.photo(user_id)),
+        ]
+
+    def plant_batch(self, user_id, trees=5):
+        buckets = " ".join(str(random.randint(1, 10_000)) for _ in range(trees))
+        album = f"album{next(self._message_ids)}"
+        return [
+            ("conv:plant_batch:start", self.text(user_id, "/plantbatch")),
+            ("conv:plant_batch:buckets", self.text(user_id, buckets)),
+            ("conv:plant_batch:location", self.location(user_id)),
+        ] + [("conv:plant_batch:photo", self.photo(user_id, album)) for _ in range(trees)]
+
+    def session(self, user_id, actions=3):
+        """A user's updates in order: sign in, then a few random flows."""
+        updates = self.register(user_id) if random.random() < 0.1 else self.login(user_id)
+        for _ in range(actions):
+            flow = random.choices(
+                [self.browse, self.menu, self.plant, self.plant_batch, self.search], weights=[5, 3, 2, 1, 2],
+            )[0]
+            updates += flow(user_id)
+        return updates
@@ -1,24 +1,46 @@
 import logging
 import asyncio
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ConversationHandler
-from config import BOT_TOKEN
+from telegram import Update
+from telegram.ext import (
+    Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler, MessageHandler, TypeHandler, filters,
+    ConversationHandler,
+)
+from config import (
+    BOT_TOKEN, TOKEN_FLUSH_INTERVAL, METRICS_PORT, METRICS_ADDR,
+    MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES, MAX_PENDING_PER_USER, MAX_QUEUED_UPDATES,
+    TELEGRAM_RATE_LIMIT, TELEGRAM_OVERALL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_GROUP_RATE,
+    TELEGRAM_MAX_RETRIES,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS,
+    WORKER_INDEX,
+    ADMISSION_CONTROL, ADMISSION_USER_RATE, ADMISSION_USER_BURST, ADMISSION_DEDUP_WINDOW,
+    ADMISSION_SHED_AT, ADMISSION_SHED_ALL_AT,
+)
+from dispatch import PerUserUpdateProcessor
+from ratelimit import PriorityRateLimiter
+from persistence import create_persistence
+from admission import AdmissionControl
+from logs import setup_logging
+import metrics
+import cluster
 from handlers import (
     start, menu_button_handler,
     login_start, login_username, login_password,
     register_start, reg_username, reg_password, reg_firstname, reg_lastname, reg_phone, reg_region, reg_birthdate,
-    plant_start, plant_bucket_id_handler, plant_location_handler, plant_photo_handler,
+    plant_start, plant_bucket_id_handler, plant_nearby_handler, plant_bucket_pick_handler,
+    plant_location_handler, plant_photo_handler,
+    plant_batch_start, plant_batch_buckets_handler, plant_batch_location_handler, plant_batch_photo_handler,
     logout_handler, cancel,
-    show_products, show_cart, show_profile,
-    add_to_cart_handler, checkout_handler,
+    show_products, products_page_handler, show_cart, show_profile,
+    add_to_cart_handler, checkout_handler, inline_search_handler,
     LOGIN_USERNAME, LOGIN_PASSWORD,
     REG_USERNAME, REG_PASSWORD, REG_FIRSTNAME, REG_LASTNAME, REG_PHONE, REG_REGION, REG_BIRTHDATE,
-    PLANT_BUCKET_ID, PLANT_WAIT_LOC, PLANT_WAIT_PHOTO
+    PLANT_BUCKET_ID, PLANT_WAIT_LOC, PLANT_WAIT_PHOTO,
+    BATCH_BUCKETS, BATCH_WAIT_LOC, BATCH_WAIT_PHOTOS,
+    api, token_store, outbox, planting_done, cart_buffer,
 )
 
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+# Enable logging; records are written by a background thread, see logs.py
+setup_logging()
 logger = logging.getLogger(__name__)
 
 async def login_callback_wrapper(update, context):
@@ -37,11 +59,73 @@ async def plant_callback_wrapper(update, context):
     await query.answer()
     return await plant_start(update, context)
 
-def main():
-    if not BOT_TOKEN:
-        print("Error: BOT_TOKEN is not set in .env file.")
+async def plant_batch_callback_wrapper(update, context):
+    query = update.callback_query
+    await query.answer()
+    return await plant_batch_start(update, context)
 
-    application = Application.builder().token(BOT_TOKEN).build()
+# Long-running tasks started in post_init and cancelled on shutdown
+background_tasks = []
+
+async def post_init(application):
+    # Serve the last known catalog from the first update on, and refresh it right away
+    api.catalog.load_snapshot()
+    api.catalog.refresh()
+    background_tasks.append(asyncio.create_task(token_store.flush_periodically(TOKEN_FLUSH_INTERVAL)))
+    outbox.on_done = lambda record, result: planting_done(application.bot, record, result)
+    outbox.start()
+
+async def post_shutdown(application):
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await outbox.stop()
+    outbox.close()
+    # Send buffered cart clicks and pending token updates, then close the shared backend connection pool
+    await cart_buffer.flush_all()
+    token_store.close()
+    if application.persistence is not None:
+        application.persistence.close()
+    await api.close()
+
+def build_application(builder=None, update_processor=None):
+    """Builds the Application with all handlers registered.
+
+    `builder` and `update_processor` can be passed in to run the bot against
+    something other than the real Telegram API, see benchmarks/.
+    """
+    if builder is None:
+        builder = Application.builder().token(BOT_TOKEN)
+    if update_processor is None:
+        update_processor = PerUserUpdateProcessor(
+            MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES, MAX_PENDING_PER_USER, MAX_QUEUED_UPDATES,
+        )
+    if TELEGRAM_RATE_LIMIT:
+        builder = builder.rate_limiter(PriorityRateLimiter(
+            TELEGRAM_OVERALL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST,
+            TELEGRAM_GROUP_RATE, max_retries=TELEGRAM_MAX_RETRIES,
+        ))
+    # Keeps conversations going across restarts, see persistence.py
+    persistence = create_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = (
+        builder
+        .concurrent_updates(update_processor)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    # -- Admission control, ahead of every other handler --
+    if ADMISSION_CONTROL:
+        admission = AdmissionControl(
+            ADMISSION_USER_RATE, ADMISSION_USER_BURST, ADMISSION_DEDUP_WINDOW, ADMISSION_SHED_AT, ADMISSION_SHED_ALL_AT,
+        )
+        application.add_handler(TypeHandler(Update, admission.admit), group=-1)
+        # Load is shed as updates arrive, before they wait for their turn
+        update_processor.shed = admission.shed
 
     # -- Conversation Handlers --
 
@@ -56,6 +140,8 @@ def main():
             LOGIN_PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, login_password)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="login",
+        persistent=persistence is not None,
     )
     application.add_handler(login_conv_handler)
 
@@ -75,6 +161,8 @@ def main():
             REG_BIRTHDATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, reg_birthdate)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="register",
+        persistent=persistence is not None,
     )
     application.add_handler(register_conv_handler)
 
@@ -85,14 +173,42 @@ def main():
             CallbackQueryHandler(plant_callback_wrapper, pattern="^plant_tree$")
         ],
         states={
-            PLANT_BUCKET_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, plant_bucket_id_handler)],
+            # The Bucket ID is typed, or picked from the buckets nearest to a location sent first
+            PLANT_BUCKET_ID: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, plant_bucket_id_handler),
+                MessageHandler(filters.LOCATION, plant_nearby_handler),
+                CallbackQueryHandler(plant_bucket_pick_handler, pattern="^plant_bucket_"),
+            ],
             PLANT_WAIT_LOC: [MessageHandler(filters.LOCATION, plant_location_handler)],
             PLANT_WAIT_PHOTO: [MessageHandler(filters.PHOTO, plant_photo_handler)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="plant",
+        persistent=persistence is not None,
     )
     application.add_handler(plant_conv_handler)
 
+    # Worker Batch Planting
+    plant_batch_conv_handler = ConversationHandler(
+        entry_points=[
+            CommandHandler("plantbatch", plant_batch_start),
+            CallbackQueryHandler(plant_batch_callback_wrapper, pattern="^plant_batch$")
+        ],
+        states={
+            BATCH_BUCKETS: [MessageHandler(filters.TEXT & ~filters.COMMAND, plant_batch_buckets_handler)],
+            # Photos right after the first location use it for every bucket
+            BATCH_WAIT_LOC: [
+                MessageHandler(filters.LOCATION, plant_batch_location_handler),
+                MessageHandler(filters.PHOTO, plant_batch_photo_handler),
+            ],
+            BATCH_WAIT_PHOTOS: [MessageHandler(filters.PHOTO, plant_batch_photo_handler)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="plant_batch",
+        persistent=persistence is not None,
+    )
+    application.add_handler(plant_batch_conv_handler)
+
     # -- Command Handlers --
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("products", show_products))
@@ -103,13 +219,50 @@ def main():
     # -- Callback Handlers --
     # Shop actions
     application.add_handler(CallbackQueryHandler(add_to_cart_handler, pattern="^add_"))
+    application.add_handler(CallbackQueryHandler(products_page_handler, pattern=r"^products_page_\d+$"))
     application.add_handler(CallbackQueryHandler(checkout_handler, pattern="^checkout$"))
     
+    # Inline product search (@bot oak); inline mode must be enabled with BotFather
+    application.add_handler(InlineQueryHandler(inline_search_handler))
+
     # Generic Menu Actions
     application.add_handler(CallbackQueryHandler(menu_button_handler, pattern="^(products|cart|profile|tips|pricing|logout)$"))
 
-    print("Bot is polling...")
-    application.run_polling()
+    metrics.instrument_application(application, outbox)
+    return application
+
+def main():
+    if not BOT_TOKEN:
+        print("Error: BOT_TOKEN is not set in .env file.")
+
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT + (WORKER_INDEX if BOT_MODE == "worker" else 0), METRICS_ADDR)
+
+    if BOT_MODE == "worker":
+        # Updates come from the cluster ingress, which also owns the webhook
+        application = build_application(Application.builder().token(BOT_TOKEN).updater(None))
+        asyncio.run(cluster.serve_worker(application, WORKER_INDEX, post_init, post_shutdown))
+        return
+
+    application = build_application()
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL or not WEBHOOK_SECRET:
+            print("Error: WEBHOOK_URL and WEBHOOK_SECRET must be set in webhook mode.")
+            return
+        print(f"Bot is serving webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+        # On shutdown the HTTP server stops first, then queued updates are processed before exiting
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        print("Bot is polling...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,66 @@
+import logging
+import time
+import httpx
+from metrics import BACKEND_BREAKER_STATE, BACKEND_REJECTED
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+STATE_NAMES = {CLOSED: "closed", HALF_OPEN: "half_open", OPEN: "open"}
+
+class BackendUnavailable(httpx.HTTPError):
+    """Raised instead of calling the backend while the circuit breaker is open.
+
+    It is an httpx.HTTPError, so every ApiService method already treats it like
+    any other failed call and falls back to cached or empty data.
+    """
+
+class CircuitBreaker:
+    """Fails backend calls fast after repeated failures instead of piling onto a struggling backend.
+
+    After `failure_threshold` consecutive failures the breaker opens and every
+    call is rejected for `reset_timeout` seconds. Then a single probe call is let
+    through (half-open): success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        # When the current half-open probe started, 0 when none is running
+        self._probe_started = 0.0
+        BACKEND_BREAKER_STATE.set(CLOSED)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning(f"Backend circuit breaker {STATE_NAMES[self.state]} -> {STATE_NAMES[state]}")
+            self.state = state
+            BACKEND_BREAKER_STATE.set(state)
+
+    def check(self, name):
+        """Raises BackendUnavailable if the call may not go to the backend right now."""
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._set_state(HALF_OPEN)
+        if self.state == CLOSED:
+            return
+        now = time.monotonic()
+        # A probe that never reported back (cancelled) is replaced after reset_timeout
+        if self.state == HALF_OPEN and now - self._probe_started >= self.reset_timeout:
+            self._probe_started = now
+            return
+        BACKEND_REJECTED.labels(name).inc()
+        raise BackendUnavailable(f"Backend unavailable, not calling {name}")
+
+    def success(self):
+        self._probe_started = 0.0
+        self.failures = 0
+        self._set_state(CLOSED)
+
+    def failure(self):
+        self._probe_started = 0.0
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(OPEN)
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from collections import Counter
+from config import CART_COALESCE_WINDOW
+
+logger = logging.getLogger(__name__)
+
+class CartWriteBuffer:
+    """Per-user write-behind buffer for add-to-cart clicks.
+
+    Clicks are summed per product and sent as one add_to_cart(count=n) per product,
+    `window` seconds after the user's first buffered click. Anything that reads the
+    cart must call flush() first so the backend totals are up to date; it also waits
+    for a send already under way and reports its failures.
+    """
+
+    def __init__(self, api, window=CART_COALESCE_WINDOW):
+        self.api = api
+        self.window = window
+        # user_id -> {"token", "counts", "on_failure"}
+        self._pending = {}
+        # user_id -> task sending the clicks taken out of _pending
+        self._sending = {}
+        self._timers = {}
+
+    def add(self, user_id, token, product_id, count=1, on_failure=None):
+        """Buffers a click and returns how many of this product are now waiting to be sent.
+
+        on_failure(product_id, count) is awaited if the deferred write fails.
+        """
+        entry = self._pending.setdefault(user_id, {"token": token, "counts": Counter(), "on_failure": on_failure})
+        entry["token"] = token
+        entry["on_failure"] = on_failure or entry["on_failure"]
+        entry["counts"][product_id] += count
+        if user_id not in self._timers:
+            self._timers[user_id] = asyncio.create_task(self._flush_later(user_id))
+        return entry["counts"][product_id]
+
+    async def _flush_later(self, user_id):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._timers.pop(user_id, None)
+        await self.flush(user_id)
+
+    async def flush(self, user_id):
+        """Sends the user's buffered clicks. Returns False if any of them failed."""
+        ok = True
+        while True:
+            sending = self._sending.get(user_id)
+            if sending is None:
+                entry = self._pending.pop(user_id, None)
+                if entry is None:
+                    return ok
+                sending = self._sending[user_id] = asyncio.create_task(self._send(user_id, entry))
+            # Shielded: a caller that gets cancelled mustn't cancel the write for the others waiting on it
+            ok = await asyncio.shield(sending) and ok
+
+    async def _send(self, user_id, entry):
+        try:
+            items = list(entry["counts"].items())
+            results = await asyncio.gather(*[
+                self.api.add_to_cart(entry["token"], product_id, count) for product_id, count in items
+            ])
+            ok = True
+            for (product_id, count), res in zip(items, results):
+                if not res:
+                    ok = False
+                    await self._notify(entry["on_failure"], product_id, count)
+            return ok
+        finally:
+            self._sending.pop(user_id, None)
+
+    async def _notify(self, on_failure, product_id, count):
+        if on_failure is None:
+            return
+        try:
+            await on_failure(product_id, count)
+        except Exception as e:
+            logger.error(f"Cart failure notification failed: {e}", exc_info=True, extra={"event": "cart.notify"})
+
+    async def flush_all(self):
+        for task in list(self._timers.values()):
+            task.cancel()
+        self._timers.clear()
+        await asyncio.gather(*[self.flush(user_id) for user_id in set(self._pending) | set(self._sending)])
@@ -0,0 +1,218 @@
+"""Runs the bot as several worker processes behind one webhook ingress.
+
+Usage (from the repo root):
+    WEBHOOK_URL=https://bot.novda.uz/telegram WEBHOOK_SECRET=... CLUSTER_WORKERS=4 python cluster.py
+
+The ingress registers the webhook with Telegram and forwards each update to the
+worker that owns its user (user id modulo the number of workers), so each user's
+updates keep their order and their in-process caches stay on one worker. It starts
+CLUSTER_WORKERS local workers (`BOT_MODE=worker python bot.py`) and restarts them
+if they exit, unless CLUSTER_WORKER_URLS points at workers running elsewhere.
+
+Telegram's overall flood limit is for the bot as a whole, so each local worker gets
+TELEGRAM_OVERALL_RATE / CLUSTER_WORKERS. Workers started elsewhere need their share
+set the same way. Per-chat limits need nothing: a chat's messages all come from one worker.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import httpx
+import tornado.httpserver
+import tornado.web
+from telegram import Bot, Update
+from config import (
+    BOT_TOKEN, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS,
+    TELEGRAM_OVERALL_RATE,
+    CLUSTER_WORKERS, CLUSTER_WORKER_HOST, CLUSTER_WORKER_PORT, CLUSTER_WORKER_URLS,
+)
+from dispatch import raw_update_key
+from logs import correlation, setup_logging
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def shard_for(key, shards):
+    # Updates without a user or chat all go to the first worker
+    return key % shards if key is not None else 0
+
+class ShardRouter:
+    """Forwards raw updates to the worker owning their user, one at a time per user."""
+
+    def __init__(self, urls, secret=None):
+        self.urls = urls
+        self.secret = secret
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(10, connect=2))
+        # key -> [lock, forwards holding or waiting for it], as in PerUserUpdateProcessor
+        self._locks = {}
+
+    async def forward(self, body):
+        """Returns the HTTP status to answer Telegram with; anything but 200 makes it retry later."""
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+        key = raw_update_key(data)
+        url = self.urls[shard_for(key, len(self.urls))]
+        with correlation(f"update-{data.get('update_id')}"):
+            return await self._forward(key, url, body)
+
+    async def _forward(self, key, url, body):
+        headers = {"Content-Type": "application/json"}
+        if self.secret:
+            headers[SECRET_HEADER] = self.secret
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                response = await self._client.post(f"{url}/update", content=body, headers=headers)
+            return 200 if response.status_code == 200 else 502
+        except httpx.HTTPError as e:
+            logger.warning(f"Forwarding update to {url} failed: {e}")
+            return 502
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def close(self):
+        await self._client.aclose()
+
+class IngressHandler(tornado.web.RequestHandler):
+    def initialize(self, router, secret):
+        self.router = router
+        self.secret = secret
+
+    async def post(self):
+        if self.secret and self.request.headers.get(SECRET_HEADER) != self.secret:
+            self.set_status(403)
+            return
+        self.set_status(await self.router.forward(self.request.body))
+
+class UpdateReceiver(tornado.web.RequestHandler):
+    """Worker side: puts updates forwarded by the ingress on the Application's queue."""
+
+    def initialize(self, bot_application, secret):
+        self.bot_application = bot_application
+        self.secret = secret
+
+    async def post(self):
+        if self.secret and self.request.headers.get(SECRET_HEADER) != self.secret:
+            self.set_status(403)
+            return
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_application.bot)
+        except ValueError:
+            self.set_status(400)
+            return
+        await self.bot_application.update_queue.put(update)
+
+def _stop_event():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+async def serve_worker(application, index, post_init, post_shutdown):
+    """Runs one worker: an Application without an Updater, fed over HTTP by the ingress."""
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([
+        (r"/update", UpdateReceiver, {"bot_application": application, "secret": WEBHOOK_SECRET}),
+    ]))
+    server.listen(CLUSTER_WORKER_PORT + index, CLUSTER_WORKER_HOST)
+    stop = _stop_event()
+
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    logger.info(f"Worker {index} listening on {CLUSTER_WORKER_HOST}:{CLUSTER_WORKER_PORT + index}")
+    await stop.wait()
+
+    # Stop taking updates; Application.stop still processes the ones already queued
+    server.stop()
+    await application.stop()
+    await application.shutdown()
+    await post_shutdown(application)
+
+class WorkerPool:
+    """Starts the local worker processes and restarts any that exit."""
+
+    def __init__(self, count):
+        self.count = count
+        self._procs = {}
+
+    def _spawn(self, index):
+        env = dict(
+            os.environ, BOT_MODE="worker", WORKER_INDEX=str(index),
+            # The workers share the bot's overall send rate
+            TELEGRAM_OVERALL_RATE=str(TELEGRAM_OVERALL_RATE / self.count),
+        )
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+        self._procs[index] = subprocess.Popen([sys.executable, script], env=env)
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(1)
+            for index, proc in list(self._procs.items()):
+                if proc.poll() is not None:
+                    logger.warning(f"Worker {index} exited with {proc.returncode}, restarting")
+                    self._spawn(index)
+
+    def stop(self):
+        for proc in self._procs.values():
+            proc.terminate()
+        for proc in self._procs.values():
+            proc.wait()
+
+async def serve_ingress():
+    pool = None
+    urls = CLUSTER_WORKER_URLS
+    if not urls:
+        pool = WorkerPool(CLUSTER_WORKERS)
+        pool.start()
+        urls = [f"http://{CLUSTER_WORKER_HOST}:{CLUSTER_WORKER_PORT + i}" for i in range(CLUSTER_WORKERS)]
+    watcher = asyncio.create_task(pool.watch()) if pool else None
+
+    router = ShardRouter(urls, WEBHOOK_SECRET)
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([
+        (f"/{WEBHOOK_PATH.lstrip('/')}", IngressHandler, {"router": router, "secret": WEBHOOK_SECRET}),
+    ]))
+    server.listen(WEBHOOK_PORT, WEBHOOK_LISTEN)
+    stop = _stop_event()
+
+    async with Bot(BOT_TOKEN) as bot:
+        await bot.set_webhook(
+            WEBHOOK_URL, secret_token=WEBHOOK_SECRET, max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    print(f"Ingress is serving webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH} for {len(urls)} workers...")
+    await stop.wait()
+
+    server.stop()
+    await router.close()
+    if watcher is not None:
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        # Workers drain their queues on SIGTERM
+        await asyncio.to_thread(pool.stop)
+
+def main():
+    setup_logging()
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        print("Error: WEBHOOK_URL and WEBHOOK_SECRET must be set for the cluster ingress.")
+        return
+    asyncio.run(serve_ingress())
+
+if __name__ == "__main__":
+    main()
@@ -6,3 +6,144 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:8000")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://127.0.0.1:3000")
+
+# How the bot receives updates: "polling", "webhook" (behind a reverse proxy), or
+# "worker" (one shard of a cluster, fed by the ingress in cluster.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Public HTTPS URL Telegram posts to, e.g. https://bot.novda.uz/telegram
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+# Sent by Telegram in X-Telegram-Bot-Api-Secret-Token, requests without it are rejected
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Cluster: the ingress (python cluster.py) takes the webhook and routes each update by
+# user id to one of CLUSTER_WORKERS worker processes, so a user always hits the same worker
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", str(os.cpu_count() or 1)))
+CLUSTER_WORKER_HOST = os.getenv("CLUSTER_WORKER_HOST", "127.0.0.1")
+# Worker i listens on CLUSTER_WORKER_PORT + i
+CLUSTER_WORKER_PORT = int(os.getenv("CLUSTER_WORKER_PORT", "9100"))
+# Comma separated worker URLs (in shard order) for workers on other machines; none are started locally then
+CLUSTER_WORKER_URLS = [url.rstrip("/") for url in os.getenv("CLUSTER_WORKER_URLS", "").split(",") if url]
+# This process's shard, set by the ingress for the workers it starts
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+
+# Update processing: different users run in parallel, each user's updates in order
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+# Updates admitted (running or waiting for their user's turn); the rest wait, in order, to be admitted
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "1000"))
+# Updates received and not finished, admitted or not. The Application starts a task for every
+# update as soon as it arrives, so this is what bounds the backlog: beyond it updates are dropped
+MAX_QUEUED_UPDATES = int(os.getenv("MAX_QUEUED_UPDATES", "5000"))
+MAX_PENDING_PER_USER = int(os.getenv("MAX_PENDING_PER_USER", "20"))
+
+# Admission control in front of the handlers (0 disables it). Each user gets a token bucket
+# for callbacks and commands (per second, burst), and the same button pressed again within
+# ADMISSION_DEDUP_WINDOW seconds is ignored. With more than ADMISSION_SHED_AT updates received
+# and not yet running, inline queries and read-only buttons are shed as they arrive; above
+# ADMISSION_SHED_ALL_AT all callbacks and commands
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1") != "0"
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "2"))
+ADMISSION_USER_BURST = int(os.getenv("ADMISSION_USER_BURST", "10"))
+ADMISSION_DEDUP_WINDOW = float(os.getenv("ADMISSION_DEDUP_WINDOW", "1"))
+ADMISSION_SHED_AT = int(os.getenv("ADMISSION_SHED_AT", str(MAX_PENDING_UPDATES // 2)))
+ADMISSION_SHED_ALL_AT = int(os.getenv("ADMISSION_SHED_ALL_AT", str(MAX_PENDING_UPDATES)))
+
+# Outgoing Bot API calls are scheduled under Telegram's flood limits (0 disables the scheduler)
+TELEGRAM_RATE_LIMIT = os.getenv("TELEGRAM_RATE_LIMIT", "1") != "0"
+# messages/sec across all chats; cluster.py hands each local worker an equal share
+TELEGRAM_OVERALL_RATE = float(os.getenv("TELEGRAM_OVERALL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # messages/sec per private chat
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", str(20 / 60)))  # messages/sec per group
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+# Backend HTTP client
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "10"))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "5"))
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", "100"))
+BACKEND_MAX_CONCURRENCY = int(os.getenv("BACKEND_MAX_CONCURRENCY", "200"))
+# Read timeouts (seconds) for slower endpoints, keyed by ApiService method name
+BACKEND_ENDPOINT_TIMEOUTS = {
+    "checkout": float(os.getenv("BACKEND_CHECKOUT_TIMEOUT", "30")),
+    "plant_tree": float(os.getenv("BACKEND_UPLOAD_TIMEOUT", "60")),
+}
+# Extra attempts for failed GETs (writes are never retried), with jittered exponential backoff
+BACKEND_GET_RETRIES = int(os.getenv("BACKEND_GET_RETRIES", "2"))
+BACKEND_RETRY_BASE = float(os.getenv("BACKEND_RETRY_BASE", "0.2"))
+# Consecutive failures that open the circuit breaker, and how long it stays open (seconds)
+BACKEND_BREAKER_THRESHOLD = int(os.getenv("BACKEND_BREAKER_THRESHOLD", "5"))
+BACKEND_BREAKER_RESET = float(os.getenv("BACKEND_BREAKER_RESET", "30"))
+
+# Streaming photo uploads
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+# Largest photo side (px) to upload; the biggest Telegram size that fits is used. 0 = original
+PHOTO_MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE", "0"))
+
+# Product catalog cache lifetime (seconds); stale data is served while it refreshes
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300"))
+# Per-user cache of profile and cart reads; our own writes invalidate it, the TTL is a fallback
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# Ordered buckets for the nearby-bucket suggestions: cache lifetime (seconds), grid cell
+# size (degrees, 0.01 is about 1 km), how many to suggest and how far away (km)
+BUCKETS_TTL = float(os.getenv("BUCKETS_TTL", "120"))
+BUCKET_GRID_SIZE = float(os.getenv("BUCKET_GRID_SIZE", "0.01"))
+NEARBY_BUCKETS = int(os.getenv("NEARBY_BUCKETS", "5"))
+NEARBY_MAX_KM = float(os.getenv("NEARBY_MAX_KM", "5"))
+# Add-to-cart clicks within this many seconds are merged into one backend call per product
+CART_COALESCE_WINDOW = float(os.getenv("CART_COALESCE_WINDOW", "1.5"))
+# Products per page in the /products browser
+PRODUCTS_PAGE_SIZE = int(os.getenv("PRODUCTS_PAGE_SIZE", "5"))
+# Inline product search (@bot oak): results per page (Telegram allows 50), searches whose
+# results are kept in memory, and how long (seconds) Telegram may cache an answer (per user,
+# since results are localized)
+INLINE_PAGE_SIZE = int(os.getenv("INLINE_PAGE_SIZE", "20"))
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "2000"))
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "60"))
+
+# Local state (token store etc.)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Last good catalog, saved on every change and served at startup until the backend answers
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", os.path.join(DATA_DIR, "catalog.json"))
+
+# User token store: "sqlite" (survives restarts) or "memory"
+TOKEN_STORE = os.getenv("TOKEN_STORE", "sqlite")
+TOKEN_DB_PATH = os.getenv("TOKEN_DB_PATH", os.path.join(DATA_DIR, "tokens.sqlite3"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_FLUSH_BATCH = int(os.getenv("TOKEN_FLUSH_BATCH", "100"))
+TOKEN_FLUSH_INTERVAL = float(os.getenv("TOKEN_FLUSH_INTERVAL", "5"))
+
+# Batch planting: most buckets in one batch, and uploads running at once per batch
+PLANT_BATCH_MAX = int(os.getenv("PLANT_BATCH_MAX", "50"))
+PLANT_BATCH_CONCURRENCY = int(os.getenv("PLANT_BATCH_CONCURRENCY", "4"))
+
+# Conversation states and user_data: "sqlite" (survives restarts) or "memory"
+STATE_STORE = os.getenv("STATE_STORE", "sqlite")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(DATA_DIR, "state.sqlite3"))
+# Changed conversations and user_data are written every this many seconds
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "5"))
+
+# Outbox for planting submissions, drained to the backend in the background.
+# Tokens and conversation state are shared by all workers, each worker has its own outbox
+OUTBOX_DIR = os.getenv("OUTBOX_DIR", os.path.join(DATA_DIR, f"outbox-{WORKER_INDEX}" if WORKER_INDEX else "outbox"))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "5"))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "600"))
+# How long (seconds) a planting refused for the user's token waits for them to log in again
+OUTBOX_AUTH_WAIT = float(os.getenv("OUTBOX_AUTH_WAIT", str(3 * 24 * 3600)))
+# How long (seconds) an uploaded planting is remembered, so a resent photo isn't planted twice
+OUTBOX_DEDUP_TTL = float(os.getenv("OUTBOX_DEDUP_TTL", str(7 * 24 * 3600)))
+
+# Logging: level, "text" or "json" lines, and the share of records kept for busy events,
+# e.g. "backend.*=0.1,outbox.retry=0.05" (see logs.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+
+# Prometheus /metrics endpoint, 0 disables it. Cluster workers use METRICS_PORT + WORKER_INDEX
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_ADDR = os.getenv("METRICS_ADDR", "127.0.0.1")
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from logs import correlation
+from metrics import UPDATES_DROPPED
+
+logger = logging.getLogger(__name__)
+
+def update_key(update):
+    """Key that orders updates: the user, else the chat. None means no ordering is needed."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+def raw_update_key(data):
+    """update_key for an Update still in its JSON form, without building the Update."""
+    for field, value in data.items():
+        if field == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+        chat = value.get("chat")
+        if chat:
+            return chat["id"]
+    return None
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes different users' updates in parallel, each user's strictly in order.
+
+    The Application takes every update off its update queue right away and hands
+    it to process_update in a task of its own, so the backlog lives here rather
+    than in the queue. Up to `max_running` updates run at once. `max_pending` caps
+    how many updates are admitted at all (running or waiting for their user's
+    turn), further ones wait to be admitted in arrival order. With `max_queued`
+    updates received and not yet finished, new ones are dropped. A single user
+    with `max_per_user` updates already queued gets the extra ones dropped too,
+    since they could only run one at a time anyway.
+    """
+
+    def __init__(self, max_running, max_pending, max_per_user, max_queued=None):
+        # The base class semaphore bounds admitted updates, ours bounds running ones
+        super().__init__(max_pending)
+        self.max_running = max_running
+        self.max_per_user = max_per_user
+        self.max_queued = max_queued
+        self._running = asyncio.Semaphore(max_running)
+        # key -> [lock, updates holding or waiting for it]
+        self._locks = {}
+        self.received = 0
+        self.in_flight = 0
+        self.dropped = 0
+        # async (update, backlog) -> True to drop the update before it waits, see admission.py
+        self.shed = None
+
+    @property
+    def pending(self):
+        """Updates admitted but not yet running."""
+        return self.current_concurrent_updates - self.in_flight
+
+    @property
+    def backlog(self):
+        """Updates received but not yet running, admitted or not."""
+        return self.received - self.in_flight
+
+    async def process_update(self, update, coroutine):
+        if self.max_queued is not None and self.received >= self.max_queued:
+            self.dropped += 1
+            UPDATES_DROPPED.labels("backlog").inc()
+            logger.warning(
+                f"Dropping update: {self.received} updates already waiting or running", extra={"event": "updates.dropped"},
+            )
+            coroutine.close()
+            return
+        self.received += 1
+        try:
+            if self.shed is not None and await self.shed(update, self.backlog):
+                coroutine.close()
+                return
+            await super().process_update(update, coroutine)
+        finally:
+            self.received -= 1
+
+    async def _run(self, coroutine):
+        async with self._running:
+            self.in_flight += 1
+            try:
+                await coroutine
+            finally:
+                self.in_flight -= 1
+
+    async def do_process_update(self, update, coroutine):
+        # Everything logged while handling the update, tasks it starts included, carries its id
+        with correlation(f"update-{update.update_id}" if isinstance(update, Update) else "-"):
+            await self._process(update, coroutine)
+
+    async def _process(self, update, coroutine):
+        key = update_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        if entry[1] >= self.max_per_user:
+            self.dropped += 1
+            UPDATES_DROPPED.labels("user").inc()
+            logger.warning(f"Dropping update for {key}: {entry[1]} already queued", extra={"event": "updates.dropped"})
+            coroutine.close()
+            return
+
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -1,10 +1,23 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputMediaPhoto
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputMediaPhoto
 from telegram.ext import ContextTypes, ConversationHandler
+from telegram.error import BadRequest
 from services import ApiService
-from config import FRONTEND_URL
+from token_store import create_token_store
+from outbox import PlantingOutbox
+from cart_buffer import CartWriteBuffer
+from ratelimit import INTERACTIVE, BULK, priority, send_priority
+from rendering import CatalogView, CHECKOUT_MARKUP, locale_of, main_menu, text
+from spatial import BucketIndex
+from search import CatalogSearch
+from config import (
+    PHOTO_MAX_SIDE, PLANT_BATCH_MAX, PLANT_BATCH_CONCURRENCY, BUCKET_GRID_SIZE, NEARBY_BUCKETS, NEARBY_MAX_KM,
+    INLINE_PAGE_SIZE, INLINE_CACHE_SIZE, INLINE_CACHE_TIME,
+)
 import logging
+import asyncio
 import datetime
-import io
+import json
+import re
 
 logger = logging.getLogger(__name__)
 
@@ -17,54 +30,57 @@ LOGIN_USERNAME, LOGIN_PASSWORD = range(2)
 REG_USERNAME, REG_PASSWORD, REG_FIRSTNAME, REG_LASTNAME, REG_PHONE, REG_REGION, REG_BIRTHDATE = range(2, 9)
 # Worker Plant
 PLANT_BUCKET_ID, PLANT_WAIT_LOC, PLANT_WAIT_PHOTO = range(9, 12)
+# Worker Batch Plant
+BATCH_BUCKETS, BATCH_WAIT_LOC, BATCH_WAIT_PHOTOS = range(12, 15)
 
-# In-memory storage for user tokens
-user_tokens = {} 
+# Catalog pages for every locale, re-rendered whenever the catalog is reloaded
+catalog_view = CatalogView()
+api.catalog.listeners.append(catalog_view.rebuild)
+
+# Inline search index over the catalog, updated along with it
+catalog_search = CatalogSearch(INLINE_PAGE_SIZE, INLINE_CACHE_SIZE)
+api.catalog.listeners.append(catalog_search.update)
+
+# Ordered buckets by location, for suggesting the nearest ones to a worker
+bucket_index = BucketIndex(BUCKET_GRID_SIZE)
+api.buckets.listeners.append(bucket_index.update)
+
+# User tokens, persisted so sessions survive restarts
+token_store = create_token_store()
+
+# Planting submissions are saved locally and uploaded in the background
+outbox = PlantingOutbox(api, token_lookup=token_store.get)
+
+# Rapid add-to-cart clicks are merged before they reach the backend
+cart_buffer = CartWriteBuffer(api)
 
 # --- Helper ---
 def get_user_token(user_id):
-    return user_tokens.get(user_id)
+    return token_store.get(user_id)
 
 def check_auth(update: Update):
     user_id = update.effective_user.id
-    return user_tokens.get(user_id)
+    return token_store.get(user_id)
+
+def forget_credentials(user_data):
+    """Drops what the login and register flows collected, so it doesn't linger in user_data."""
+    for key in [k for k in user_data if k.startswith(("login_", "reg_"))]:
+        del user_data[key]
 
 # --- Start & Menu ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends a welcome message with the Mini App button and main menu."""
     try:
         user = update.effective_user
-        logger.info(f"Start command from {user.id}")
+        logger.info(f"Start command from {user.id}", extra={"event": "command.start"})
         
         token = get_user_token(user.id)
-        auth_status = "✅ Logged In" if token else "❌ Not Logged In"
-
-        keyboard = []
-        if not token:
-            keyboard.append([InlineKeyboardButton("Login", callback_data="login"), InlineKeyboardButton("Register", callback_data="register")])
-        else:
-            # We add Logout and Profile
-            keyboard.append([InlineKeyboardButton("Logout", callback_data="logout"), InlineKeyboardButton("Profile", callback_data="profile")])
-        
-        # Shop
-        keyboard.append([InlineKeyboardButton("Products", callback_data="products"), InlineKeyboardButton("My Cart", callback_data="cart")])
-        
-        # Web App
-        keyboard.append([InlineKeyboardButton("Open Novda App", web_app=WebAppInfo(url=FRONTEND_URL))])
-        
-        # Info
-        keyboard.append([InlineKeyboardButton("Tips", callback_data="tips"), InlineKeyboardButton("Pricing", callback_data="pricing")])
-        
-        # Worker - we can't easily validte worker status without /me check every time.
-        # We'll just add the button if logged in, ensuring they can access the feature if they have permissions.
-        if token:
-             keyboard.append([InlineKeyboardButton("Worker: Plant Tree", callback_data="plant_tree")])
+        locale = locale_of(user)
+        auth_status = text(locale, "logged_in" if token else "logged_out")
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
-            f"Hello {user.first_name}! Welcome to Novda Bot.\nStatus: {auth_status}\n\nUse the menu below:",
-            reply_markup=reply_markup
+            text(locale, "welcome", name=user.first_name, status=auth_status),
+            reply_markup=main_menu(locale, token)
         )
     except Exception as e:
         logger.error(f"Error in start: {e}", exc_info=True)
@@ -83,33 +99,41 @@ async def menu_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     elif data == "profile":
         await show_profile(update, context)
     elif data == "tips":
-        await update.effective_message.reply_text("🌱 *Planting Tips*:\n1. Choose sunny locations.\n2. Water regularly.\n3. Protect from pests.\n4. Use organic fertilizer.", parse_mode='Markdown')
+        with send_priority(BULK):
+            await update.effective_message.reply_text("🌱 *Planting Tips*:\n1. Choose sunny locations.\n2. Water regularly.\n3. Protect from pests.\n4. Use organic fertilizer.", parse_mode='Markdown')
     elif data == "pricing":
-         await update.effective_message.reply_text("💰 *Pricing*:\nSmall Tree: $10\nMedium Tree: $25\nBig Tree: $50\n\n_Prices subject to change._", parse_mode='Markdown')
+        with send_priority(BULK):
+            await update.effective_message.reply_text("💰 *Pricing*:\nSmall Tree: $10\nMedium Tree: $25\nBig Tree: $50\n\n_Prices subject to change._", parse_mode='Markdown')
     elif data == "logout":
         await logout_handler(update, context)
 
 # --- Authentication ---
 
 # Login
+@priority(INTERACTIVE)
 async def login_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Please enter your username:")
     return LOGIN_USERNAME
 
+@priority(INTERACTIVE)
 async def login_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['login_username'] = update.message.text
     await update.message.reply_text("Please enter your password:")
     return LOGIN_PASSWORD
 
+@priority(INTERACTIVE)
 async def login_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    username = context.user_data['login_username']
+    username = context.user_data.get('login_username')
     password = update.message.text
+    forget_credentials(context.user_data)
     
-    result = api.login(username, password)
+    result = await api.login(username, password)
     
     if result and 'access' in result:
         user_id = update.effective_user.id
-        user_tokens[user_id] = result['access']
+        token_store.set(user_id, result['access'])
+        # Plantings refused for an expired token can go now
+        outbox.retry_user(user_id)
         await update.message.reply_text("Login successful!")
         await start(update, context)
         return ConversationHandler.END
@@ -119,11 +143,10 @@ async def login_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def logout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    token = user_tokens.get(user_id)
+    token = token_store.get(user_id)
     if token:
-        api.logout(token)
-        if user_id in user_tokens:
-            del user_tokens[user_id]
+        await api.logout(token)
+        token_store.delete(user_id)
         await update.effective_message.reply_text("Logged out successfully.")
     else:
         await update.effective_message.reply_text("You are not logged in.")
@@ -131,42 +154,55 @@ async def logout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # We can trigger start to show login buttons, but message is enough.
 
 # Registration
+@priority(INTERACTIVE)
 async def register_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Registration - Step 1/7\nEnter your desired username:")
     return REG_USERNAME
 
+@priority(INTERACTIVE)
 async def reg_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['reg_username'] = update.message.text
     await update.message.reply_text("Step 2/7\nEnter your password:")
     return REG_PASSWORD
 
+@priority(INTERACTIVE)
 async def reg_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['reg_password'] = update.message.text
     await update.message.reply_text("Step 3/7\nEnter your First Name:")
     return REG_FIRSTNAME
 
+@priority(INTERACTIVE)
 async def reg_firstname(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['reg_firstname'] = update.message.text
     await update.message.reply_text("Step 4/7\nEnter your Last Name:")
     return REG_LASTNAME
 
+@priority(INTERACTIVE)
 async def reg_lastname(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['reg_lastname'] = update.message.text
     await update.message.reply_text("Step 5/7\nEnter your Phone Number:")
     return REG_PHONE
 
+@priority(INTERACTIVE)
 async def reg_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['reg_phone'] = update.message.text
     await update.message.reply_text("Step 6/7\nEnter your Region (e.g. Tashkent, Samarkand):")
     return REG_REGION
 
+@priority(INTERACTIVE)
 async def reg_region(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['reg_region'] = update.message.text
     await update.message.reply_text("Step 7/7\nEnter your Birth Date (YYYY-MM-DD):")
     return REG_BIRTHDATE
 
+@priority(INTERACTIVE)
 async def reg_birthdate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     dob = update.message.text
+    # The password is never persisted, a restart mid-registration loses it
+    if 'reg_password' not in context.user_data:
+        forget_credentials(context.user_data)
+        await update.message.reply_text("Registration expired, please start again with /register.")
+        return ConversationHandler.END
     data = {
         "username": context.user_data['reg_username'],
         "password": context.user_data['reg_password'],
@@ -177,11 +213,12 @@ async def reg_birthdate(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "birthDate": dob,
         "email": "" 
     }
+    forget_credentials(context.user_data)
     
-    res = api.register(data)
+    res = await api.register(data)
     if res and 'access' in res:
         user_id = update.effective_user.id
-        user_tokens[user_id] = res['access']
+        token_store.set(user_id, res['access'])
         await update.message.reply_text("Registration Successful! You are now logged in.")
         await start(update, context)
     else:
@@ -196,40 +233,76 @@ async def reg_birthdate(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- Shop Handlers ---
 
 async def show_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    products = api.get_products()
+    products = await api.get_products()
     target = update.effective_message
+    locale = locale_of(update.effective_user)
     
     if not products:
-        await target.reply_text("No products found.")
+        await target.reply_text(text(locale, "no_products"))
         return
 
-    for p in products[:5]:
-        name = p.get('tree', {}).get('name_en', 'Tree')
-        price = p.get('price', '0')
-        desc = p.get('tree', {}).get('desc_en', '')
-        
-        msg = f"🌳 *{name}*\nPrice: ${price}\n{desc}"
-        
-        keyboard = [[InlineKeyboardButton("Add to Cart", callback_data=f"add_{p['id']}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await target.reply_text(msg, parse_mode='Markdown', reply_markup=reply_markup)
+    msg, reply_markup = catalog_view.page(locale, 0)
+    await target.reply_text(msg, parse_mode='Markdown', reply_markup=reply_markup)
 
-async def add_to_cart_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def products_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Turns the page of the product browser by editing the message in place."""
     query = update.callback_query
     await query.answer()
+
+    products = await api.get_products()
+    locale = locale_of(update.effective_user)
+    if not products:
+        await query.edit_message_text(text(locale, "no_products"))
+        return
+
+    page = int(query.data.rsplit('_', 1)[1])
+    msg, reply_markup = catalog_view.page(locale, page)
+    try:
+        await query.edit_message_text(msg, parse_mode='Markdown', reply_markup=reply_markup)
+    except BadRequest as e:
+        # Pressing the current page number leaves the message unchanged
+        if "not modified" not in str(e):
+            raise
+
+async def add_to_cart_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
     
     token = check_auth(update)
     if not token:
+        # Buttons on inline search results sit in other chats, there is no message of ours to reply to
+        if query.message is None:
+            await query.answer("Please login first.", show_alert=True)
+            return
+        await query.answer()
         await query.message.reply_text("Please login first.")
         return
 
     _, product_id = query.data.split('_')
-    res = api.add_to_cart(token, product_id)
-    if res:
-        await query.message.reply_text("Added to cart! 🛒")
-    else:
-        await query.message.reply_text("Failed to add.")
+
+    async def add_failed(product_id, count):
+        if query.message is None:
+            await context.bot.send_message(update.effective_user.id, "Failed to add.")
+        else:
+            await query.message.reply_text("Failed to add.")
+
+    # Buffered, the click is sent along with any others on this product a moment later
+    count = cart_buffer.add(update.effective_user.id, token, product_id, on_failure=add_failed)
+    await query.answer(f"Added to cart! 🛒 (+{count})" if count > 1 else "Added to cart! 🛒")
+
+@priority(INTERACTIVE)
+async def inline_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answers `@bot oak` with matching products, a page at a time, from the in-memory index."""
+    inline_query = update.inline_query
+    # Keeps the catalog, and with it the index, fresh; only a cold cache waits for the backend
+    await api.get_products()
+    locale = locale_of(update.effective_user)
+    try:
+        offset = max(int(inline_query.offset or 0), 0)
+    except ValueError:
+        offset = 0
+    results, next_offset = catalog_search.page(locale, inline_query.query, offset)
+    # The results are localized, so Telegram must not serve them to others sending the same query
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True, next_offset=next_offset)
 
 async def show_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     token = check_auth(update)
@@ -239,30 +312,30 @@ async def show_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await target.reply_text("Please login first.")
         return
 
-    items = api.get_my_trees(token)
+    await cart_buffer.flush(update.effective_user.id)
+    items = await api.get_my_trees(token)
+    locale = locale_of(update.effective_user)
     if not items:
-        await target.reply_text("Your cart is empty.")
+        await target.reply_text(text(locale, "cart_empty"))
         return
 
-    msg = "🛒 *Your Cart*\n\n"
+    lines = [text(locale, "cart_title"), ""]
     total_price = 0
     
     for item in items:
-        p_name = item['product']['tree'].get('name_en', 'Tree')
+        p_name = catalog_view.name(item['product'], locale)
         price = float(item['product'].get('price', 0))
         qty = item.get('count', 1)
         line_total = price * qty
         total_price += line_total
         
-        msg += f"- {p_name} (x{qty}) - ${line_total}\n"
+        lines.append(f"- {p_name} (x{qty}) - ${line_total}")
 
-    msg += f"\n*Total: ${total_price}*"
-    
-    keyboard = [[InlineKeyboardButton("Checkout", callback_data="checkout")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    lines.append(f"\n*{text(locale, 'total')}: ${total_price}*")
     
-    await target.reply_text(msg, parse_mode='Markdown', reply_markup=reply_markup)
+    await target.reply_text("\n".join(lines), parse_mode='Markdown', reply_markup=CHECKOUT_MARKUP[locale])
 
+@priority(INTERACTIVE)
 async def checkout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -271,7 +344,11 @@ async def checkout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("Login required.")
         return
         
-    res = api.checkout(token)
+    if not await cart_buffer.flush(update.effective_user.id):
+        await query.message.reply_text("Some items could not be added to your cart, please check /cart before checking out.")
+        return
+
+    res = await api.checkout(token)
     if res:
         await query.message.reply_text("✅ Order placed successfully!")
     else:
@@ -284,7 +361,7 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await target.reply_text("Login required.")
         return
         
-    me = api.get_me(token)
+    me = await api.get_me(token)
     if me:
         name = me.get('name', 'User')
         region = me.get('region', 'Unknown')
@@ -293,12 +370,15 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await target.reply_text("Could not load profile.")
 
+@priority(INTERACTIVE)
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    forget_credentials(context.user_data)
     await update.message.reply_text("Operation cancelled.")
     return ConversationHandler.END
 
 
 # --- Worker Planting Flow ---
+@priority(INTERACTIVE)
 async def plant_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     token = check_auth(update)
     # We allow entering but later api call will fail if not worker content permissions
@@ -306,14 +386,61 @@ async def plant_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
          await update.effective_message.reply_text("Login required.")
          return ConversationHandler.END
 
-    await update.effective_message.reply_text("🌱 Worker: Planting Tree\nPlease enter the Bucket ID you are planting:")
+    # A location from an earlier planting must not skip this one's location step
+    context.user_data.pop('plant_lat', None)
+    context.user_data.pop('plant_lon', None)
+    await update.effective_message.reply_text(
+        "🌱 Worker: Planting Tree\nSend the GPS location of the tree (Attach Location) to see the nearest "
+        "ordered buckets, or enter the Bucket ID you are planting:"
+    )
     return PLANT_BUCKET_ID 
 
+@priority(INTERACTIVE)
 async def plant_bucket_id_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['plant_bucket_id'] = update.message.text
+    if 'plant_lat' in context.user_data:
+        await update.message.reply_text("Now send a photo of the planted tree.")
+        return PLANT_WAIT_PHOTO
     await update.message.reply_text("Send me the GPS location of the tree (Attach Location).")
     return PLANT_WAIT_LOC
 
+def format_distance(km):
+    return f"{km * 1000:.0f} m" if km < 1 else f"{km:.1f} km"
+
+@priority(INTERACTIVE)
+async def plant_nearby_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Location sent before the Bucket ID: offers the nearest ordered buckets as buttons."""
+    loc = update.message.location
+    context.user_data['plant_lat'] = loc.latitude
+    context.user_data['plant_lon'] = loc.longitude
+
+    # Loads or refreshes bucket_index through the cache listener; None for users who aren't workers
+    buckets = await api.get_ordered_buckets(check_auth(update))
+    nearby = bucket_index.nearest(loc.latitude, loc.longitude, NEARBY_BUCKETS, NEARBY_MAX_KM) if buckets is not None else []
+    if not nearby:
+        await update.message.reply_text("No ordered buckets found nearby. Please enter the Bucket ID:")
+        return PLANT_BUCKET_ID
+
+    keyboard = [
+        [InlineKeyboardButton(f"Bucket {b['id']} · {format_distance(km)}", callback_data=f"plant_bucket_{b['id']}")]
+        for km, b in nearby
+    ]
+    await update.message.reply_text(
+        "Nearest ordered buckets, pick one or enter the Bucket ID:", reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return PLANT_BUCKET_ID
+
+@priority(INTERACTIVE)
+async def plant_bucket_pick_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    bucket = query.data[len("plant_bucket_"):]
+    context.user_data['plant_bucket_id'] = bucket
+    await query.edit_message_text(f"Bucket {bucket} selected.")
+    await query.message.reply_text("Now send a photo of the planted tree.")
+    return PLANT_WAIT_PHOTO
+
+@priority(INTERACTIVE)
 async def plant_location_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.location:
         await update.message.reply_text("Please send a valid location attachment.")
@@ -326,33 +453,174 @@ async def plant_location_handler(update: Update, context: ContextTypes.DEFAULT_T
     await update.message.reply_text("Now send a photo of the planted tree.")
     return PLANT_WAIT_PHOTO
 
+def pick_photo_size(sizes, max_side=PHOTO_MAX_SIDE):
+    """Largest PhotoSize whose longest side fits max_side (the smallest one if none does)."""
+    if not max_side:
+        return sizes[-1]
+    fitting = [p for p in sizes if max(p.width, p.height) <= max_side]
+    return fitting[-1] if fitting else sizes[0]
+
+def planting_data(bucket, lat, lon):
+    return {
+        "bucket": bucket,
+        "latitude": lat,
+        "lognitude": lon, 
+        "plantingDate": datetime.datetime.now().isoformat()
+    }
+
+@priority(INTERACTIVE)
 async def plant_photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.photo:
          await update.message.reply_text("Please send a photo.")
          return PLANT_WAIT_PHOTO
          
-    photo_file = await update.message.photo[-1].get_file()
-    
-    f = io.BytesIO()
-    await photo_file.download_to_memory(f)
-    f.seek(0)
+    photo = pick_photo_size(update.message.photo)
+    photo_file = await photo.get_file()
     
-    token = get_user_token(update.effective_user.id)
-    
-    data = {
-        "bucket": context.user_data['plant_bucket_id'],
-        "latitude": context.user_data['plant_lat'],
-        "lognitude": context.user_data['plant_lon'], 
-        "plantingDate": datetime.datetime.now().isoformat()
-    }
-    
-    files = {'images': ('planted.jpg', f, 'image/jpeg')}
+    user_id = update.effective_user.id
+    token = get_user_token(user_id)
     
-    res = api.plant_tree(token, data, files)
+    data = planting_data(context.user_data['plant_bucket_id'], context.user_data['plant_lat'], context.user_data['plant_lon'])
     
-    if res:
-        await update.message.reply_text("Tree planting recorded successfully! 🌳✅")
+    # Streamed from Telegram to disk, the outbox uploads it once the backend is reachable
+    try:
+        status, _ = await outbox.add(
+            user_id, update.effective_chat.id, token, data, api.iter_file(photo_file.file_path), photo.file_unique_id
+        )
+    except Exception as e:
+        logger.error(f"Saving planting failed: {e}", exc_info=True)
+        await update.message.reply_text("Failed to save the photo. Please send it again.")
+        return PLANT_WAIT_PHOTO
+
+    if status == "duplicate":
+        await update.message.reply_text("This planting was already submitted, no need to send it again 🌳")
     else:
-        await update.message.reply_text("Failed to record planting. Check Bucket ID or permissions.")
-        
+        await update.message.reply_text("Tree planting saved 🌳 It will be uploaded in the background, I'll let you know once it's recorded.")
     return ConversationHandler.END
+
+async def planting_done(bot, record, result):
+    """Outbox callback: tells the worker how their planting upload ended."""
+    bucket = json.loads(record['data']).get('bucket')
+    if result is not None:
+        bucket_index.remove(bucket)
+        msg = f"Tree planting for bucket {bucket} recorded successfully! 🌳✅"
+    else:
+        msg = f"Planting for bucket {bucket} was rejected. Check Bucket ID or permissions."
+    with send_priority(BULK):
+        await bot.send_message(record['chat_id'], msg)
+
+
+# --- Worker Batch Planting Flow ---
+# Bucket IDs, then one location for all of them or one per bucket, then an album with a photo per bucket
+@priority(INTERACTIVE)
+async def plant_batch_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not check_auth(update):
+        await update.effective_message.reply_text("Login required.")
+        return ConversationHandler.END
+
+    await update.effective_message.reply_text(
+        f"🌱 Worker: Batch Planting\nSend the Bucket IDs you are planting (up to {PLANT_BATCH_MAX}), "
+        "separated by spaces, commas or new lines:"
+    )
+    return BATCH_BUCKETS
+
+@priority(INTERACTIVE)
+async def plant_batch_buckets_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    buckets = [b for b in re.split(r"[\s,;]+", update.message.text) if b]
+    if not buckets or len(buckets) > PLANT_BATCH_MAX:
+        await update.message.reply_text(f"Please send between 1 and {PLANT_BATCH_MAX} Bucket IDs.")
+        return BATCH_BUCKETS
+
+    context.user_data['batch_buckets'] = buckets
+    context.user_data['batch_locations'] = []
+    context.user_data['batch_photos'] = []
+    await update.message.reply_text(
+        f"{len(buckets)} buckets. Send the GPS location (Attach Location), one for all of them "
+        "or one per bucket in the same order."
+    )
+    return BATCH_WAIT_LOC
+
+@priority(INTERACTIVE)
+async def plant_batch_location_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    buckets = context.user_data['batch_buckets']
+    locations = context.user_data['batch_locations']
+    loc = update.message.location
+    locations.append([loc.latitude, loc.longitude])
+
+    remaining = len(buckets) - len(locations)
+    if remaining == 0:
+        await update.message.reply_text("Now send the photos as an album, one per bucket in the same order.")
+        return BATCH_WAIT_PHOTOS
+    if len(locations) == 1:
+        await update.message.reply_text(
+            f"Location saved. Send {remaining} more (one per bucket), or send the photos now to use it for all buckets."
+        )
+    else:
+        await update.message.reply_text(f"Location saved, {remaining} more to go.")
+    return BATCH_WAIT_LOC
+
+@priority(INTERACTIVE)
+async def plant_batch_photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    buckets = context.user_data['batch_buckets']
+    locations = context.user_data['batch_locations']
+    if len(locations) not in (1, len(buckets)):
+        await update.message.reply_text(f"Please send the remaining {len(buckets) - len(locations)} locations first.")
+        return BATCH_WAIT_LOC
+
+    photos = context.user_data['batch_photos']
+    photo = pick_photo_size(update.message.photo)
+    photos.append([photo.file_id, photo.file_unique_id])
+    if len(photos) < len(buckets):
+        # Each photo of an album is its own update, so stay quiet until the last one
+        if update.message.media_group_id is None:
+            await update.message.reply_text(f"Photo {len(photos)} of {len(buckets)} saved.")
+        return BATCH_WAIT_PHOTOS
+
+    if len(locations) == 1:
+        locations = locations * len(buckets)
+    items = [(bucket, lat, lon, *photo) for bucket, (lat, lon), photo in zip(buckets, locations, photos)]
+    for key in ('batch_buckets', 'batch_locations', 'batch_photos'):
+        context.user_data.pop(key, None)
+
+    user_id = update.effective_user.id
+    context.application.create_task(
+        submit_planting_batch(context.bot, user_id, update.effective_chat.id, items), update=update
+    )
+    await update.message.reply_text(f"Uploading {len(items)} plantings 🌳 I'll send a summary when they're done.")
+    return ConversationHandler.END
+
+async def submit_planting_batch(bot, user_id, chat_id, items):
+    """Uploads a batch, PLANT_BATCH_CONCURRENCY at a time, and reports every item in one summary.
+
+    Uploads the backend can't take right now go to the outbox, which reports them when they land.
+    """
+    semaphore = asyncio.Semaphore(PLANT_BATCH_CONCURRENCY)
+
+    async def submit(bucket, lat, lon, file_id, file_unique_id):
+        async with semaphore:
+            try:
+                photo_file = await bot.get_file(file_id)
+                return await outbox.submit(
+                    user_id, chat_id, get_user_token(user_id), planting_data(bucket, lat, lon),
+                    photo_file.file_path, file_unique_id,
+                )
+            except Exception as e:
+                logger.error(f"Batch planting for bucket {bucket} failed: {e}", exc_info=True)
+                return "failed", str(e)
+
+    results = await asyncio.gather(*[submit(*item) for item in items])
+    uploaded = sum(1 for status, _ in results if status == "uploaded")
+    lines = [f"🌳 Batch planting: {uploaded} of {len(items)} recorded"]
+    for (bucket, *_), (status, _) in zip(items, results):
+        if status == "uploaded":
+            bucket_index.remove(bucket)
+            lines.append(f"✅ Bucket {bucket}")
+        elif status == "duplicate":
+            lines.append(f"↩️ Bucket {bucket}: already submitted, skipped")
+        elif status == "queued":
+            lines.append(f"⏳ Bucket {bucket}: backend busy, will retry and let you know")
+        elif status == "rejected":
+            lines.append(f"❌ Bucket {bucket}: rejected, check Bucket ID or permissions")
+        else:
+            lines.append(f"❌ Bucket {bucket}: photo could not be fetched, please plant it again")
+    await bot.send_message(chat_id, "\n".join(lines))
@@ -0,0 +1,123 @@
+"""Logging off the event loop: records are queued and written by a background thread.
+
+setup_logging() puts a QueueHandler on the root logger. On the calling thread a
+record only gets its correlation id, passes sampling and is put on an in-process
+queue; a QueueListener thread formats it (text or JSON lines) and writes it out,
+so a burst of errors never blocks the event loop on stderr.
+
+Log calls can tag a record with an event name, `extra={"event": "backend.login"}`.
+LOG_SAMPLE keeps only a share of the records of busy events, e.g.
+"backend.*=0.1,outbox.retry=0.05"; everything else is always kept.
+"""
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE
+from metrics import LOG_SAMPLED_OUT
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s"
+
+# Identifies the update (or background job) a record was logged for
+_correlation_id = contextvars.ContextVar("correlation_id", default="-")
+
+@contextlib.contextmanager
+def correlation(correlation_id):
+    """Records logged inside the block, and in tasks started from it, carry `correlation_id`."""
+    token = _correlation_id.set(correlation_id)
+    try:
+        yield
+    finally:
+        _correlation_id.reset(token)
+
+def parse_sample_rates(spec):
+    """"backend.*=0.1,outbox.retry=0.05" -> {"backend.*": 0.1, "outbox.retry": 0.05}"""
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        event, _, rate = part.partition("=")
+        rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+class ContextFilter(logging.Filter):
+    """Stamps the correlation id and drops the sampled-out share of busy events."""
+
+    def __init__(self, sample_rates=None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+
+    def _rate(self, event):
+        rate = self.sample_rates.get(event)
+        if rate is None and "." in event:
+            rate = self.sample_rates.get(event.split(".", 1)[0] + ".*")
+        return rate
+
+    def filter(self, record):
+        record.correlation_id = _correlation_id.get()
+        event = getattr(record, "event", None)
+        if event is not None and self.sample_rates:
+            rate = self._rate(event)
+            if rate is not None:
+                if random.random() >= rate:
+                    LOG_SAMPLED_OUT.labels(event).inc()
+                    return False
+                record.sample_rate = rate
+        return True
+
+class QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # The queue never leaves the process, so the record doesn't need to be made picklable;
+        # merging the arguments now is all it takes, formatting is left to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+# LogRecord attributes that aren't extra fields
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "correlation_id"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any `extra` fields alongside the standard ones."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+_listener = None
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, sample=LOG_SAMPLE):
+    """Routes the root logger through the queue. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return _listener
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    handler.addFilter(ContextFilter(parse_sample_rates(sample)))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    # Writes out whatever is still queued when the process exits
+    atexit.register(_listener.stop)
+    return _listener
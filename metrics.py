@@ -0,0 +1,90 @@
+import functools
+import time
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+
+BACKEND_LATENCY = Histogram(
+    "novda_backend_request_seconds", "Backend call latency by ApiService method and HTTP status",
+    ["method", "status"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+BACKEND_DEDUPED = Counter(
+    "novda_backend_deduplicated_total", "GETs answered by an identical request already in flight", ["method"]
+)
+BACKEND_IN_FLIGHT = Gauge("novda_backend_requests_in_flight", "Backend calls currently in flight")
+BACKEND_RETRIES = Counter("novda_backend_retries_total", "GETs retried after a failed attempt", ["method"])
+BACKEND_REJECTED = Counter(
+    "novda_backend_rejected_total", "Backend calls failed fast because the circuit breaker was open", ["method"]
+)
+BACKEND_BREAKER_STATE = Gauge("novda_backend_breaker_state", "Backend circuit breaker: 0 closed, 1 half-open, 2 open")
+HANDLER_LATENCY = Histogram(
+    "novda_handler_seconds", "Handler duration by callback name", ["handler"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+HANDLER_ERRORS = Counter("novda_handler_errors_total", "Handlers that raised", ["handler"])
+UPDATE_QUEUE_DEPTH = Gauge("novda_update_queue_depth", "Updates received but not yet running")
+UPDATES_PENDING = Gauge("novda_updates_pending", "Updates admitted and waiting for their user's turn")
+UPDATES_IN_FLIGHT = Gauge("novda_updates_in_flight", "Updates currently being processed")
+UPDATES_DROPPED = Counter(
+    "novda_updates_dropped_total", "Updates dropped because their user had too many queued (user) or the backlog was full (backlog)",
+    ["reason"],
+)
+UPDATES_REJECTED = Counter(
+    "novda_updates_rejected_total", "Updates turned away by admission control, by reason and update kind",
+    ["reason", "kind"],
+)
+OUTGOING_QUEUED = Gauge("novda_outgoing_queued", "Outgoing Bot API calls waiting for a global send slot", ["lane"])
+OUTGOING_RETRY_AFTER = Counter("novda_outgoing_retry_after_total", "RetryAfter (flood control) errors from Telegram")
+LOG_SAMPLED_OUT = Counter("novda_log_records_sampled_out_total", "Log records dropped by LOG_SAMPLE", ["event"])
+OUTBOX_PENDING = Gauge("novda_outbox_pending", "Planting submissions waiting to be uploaded")
+
+def timed(callback):
+    """Wraps a handler callback so its duration is recorded under its function name."""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(name).observe(time.perf_counter() - started)
+    wrapper.timed = True
+    return wrapper
+
+def _instrument(handler):
+    if isinstance(handler, ConversationHandler):
+        for nested in handler.entry_points + handler.fallbacks:
+            _instrument(nested)
+        for handlers in handler.states.values():
+            for nested in handlers:
+                _instrument(nested)
+    elif not getattr(handler.callback, "timed", False):
+        handler.callback = timed(handler.callback)
+
+def instrument_application(application, outbox=None):
+    """Times every registered handler and exports the update pipeline gauges."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument(handler)
+
+    processor = application.update_processor
+    # With concurrent updates the Application empties update_queue at once, the backlog waits in the processor
+    UPDATE_QUEUE_DEPTH.set_function(
+        lambda: getattr(processor, "backlog", application.update_queue.qsize())
+    )
+    UPDATES_PENDING.set_function(lambda: getattr(processor, "pending", 0))
+    UPDATES_IN_FLIGHT.set_function(
+        lambda: getattr(processor, "in_flight", processor.current_concurrent_updates)
+    )
+    if outbox is not None:
+        OUTBOX_PENDING.set_function(outbox.pending_count)
+
+def serve(port, addr="0.0.0.0"):
+    """Starts the /metrics endpoint in a background thread."""
+    start_http_server(port, addr=addr)
@@ -0,0 +1,337 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+import httpx
+from config import OUTBOX_DIR, OUTBOX_WORKERS, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX, OUTBOX_DEDUP_TTL, OUTBOX_AUTH_WAIT
+from logs import correlation
+
+logger = logging.getLogger(__name__)
+
+# Responses that mean the token is no good (expired, or the user logged out); the
+# submission waits for the user's next login instead of being rejected
+AUTH_STATUSES = (401, 403)
+
+# Responses that mean the submission itself is wrong, retrying won't help
+def _is_permanent(status_code):
+    return 400 <= status_code < 500 and status_code not in (408, 429) + AUTH_STATUSES
+
+# How often (seconds) expired fingerprints of uploaded plantings are deleted
+FINGERPRINT_PURGE_INTERVAL = 3600
+
+def _remove_photo(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+def _place(data):
+    """The bucket and spot a submission is for, as part of its fingerprints."""
+    lat, lon = data.get("latitude"), data.get("lognitude")
+    if lat is not None and lon is not None:
+        lat, lon = round(float(lat), 6), round(float(lon), 6)
+    return f"{data.get('bucket')}|{lat}|{lon}"
+
+class PlantingOutbox:
+    """Disk-backed queue of tree-planting submissions.
+
+    add() writes the photo and the form data to OUTBOX_DIR and returns right away.
+    Background workers then upload pending submissions to /api/plant/tree/, retrying
+    with jittered exponential backoff, so nothing is lost while the backend is down.
+    Submissions are only removed once the backend has accepted or rejected them.
+    One refused for its token (401/403) keeps retrying, and retry_user() sends it
+    as soon as the user logs in again; after OUTBOX_AUTH_WAIT seconds it is given up.
+
+    Every submission is fingerprinted by the sha256 of its photo and its bucket and
+    location, and by the Telegram file_unique_id when given. A repeat of one that is
+    still queued or was uploaded in the last OUTBOX_DEDUP_TTL seconds is not saved
+    or sent again, and the file_unique_id check skips even the photo download.
+    The content fingerprint also goes to the backend as an Idempotency-Key.
+    """
+
+    def __init__(self, api, path=OUTBOX_DIR, workers=OUTBOX_WORKERS, token_lookup=None):
+        self.api = api
+        self.workers = workers
+        # Prefer the user's current token at upload time, the stored one may have expired
+        self.token_lookup = token_lookup
+        # Called with (record, result) when a submission is uploaded, and with
+        # (record, None) when the backend rejects it for good
+        self.on_done = None
+        self._photo_dir = os.path.join(path, "photos")
+        os.makedirs(self._photo_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(path, "outbox.sqlite3"))
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS plantings ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, chat_id INTEGER, token TEXT, "
+            "data TEXT NOT NULL, photo_path TEXT NOT NULL, file_size INTEGER, "
+            "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, last_error TEXT, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS plantings_due ON plantings (status, next_attempt_at)")
+        columns = [row["name"] for row in self._db.execute("PRAGMA table_info(plantings)")]
+        if "idempotency_key" not in columns:
+            self._db.execute("ALTER TABLE plantings ADD COLUMN idempotency_key TEXT")
+        # key -> submission, status is 'pending' until uploaded
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "key TEXT PRIMARY KEY, planting_id INTEGER NOT NULL, status TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS fingerprints_planting ON fingerprints (planting_id)")
+        self._db.commit()
+        self._purged_at = 0.0
+        self._purge_fingerprints()
+        # Kept in memory so it can be read from the metrics thread
+        self._pending = self._db.execute("SELECT COUNT(*) FROM plantings WHERE status = 'pending'").fetchone()[0]
+        self._queue = None
+        self._claimed = set()
+        self._wakeup = None
+        self._tasks = []
+
+    async def add(self, user_id, chat_id, token, data, chunks, file_unique_id=None):
+        """Saves a submission, streaming the photo from `chunks` to disk.
+
+        Returns ("queued", id), or ("duplicate", id of the earlier submission) for a repeat.
+        """
+        return await self._save(user_id, chat_id, token, data, chunks, file_unique_id)
+
+    async def submit(self, user_id, chat_id, token, data, file_path, file_unique_id=None):
+        """Saves a submission and uploads it right away, leaving it queued if the backend can't take it now.
+
+        `file_path` is a Telegram file path or URL, see ApiService.iter_file. Returns
+        ("uploaded", result), ("rejected", reason), ("queued", id) or ("duplicate", id).
+        on_done is only called for queued submissions, the caller reports the others.
+        """
+        status, planting_id = await self._save(
+            user_id, chat_id, token, data, self.api.iter_file(file_path), file_unique_id, claim=True
+        )
+        if status == "duplicate":
+            return status, planting_id
+        try:
+            row = self._db.execute("SELECT * FROM plantings WHERE id = ?", (planting_id,)).fetchone()
+            return await self._upload(row, notify=False)
+        finally:
+            self._claimed.discard(planting_id)
+
+    def _duplicate(self, keys):
+        placeholders = ", ".join("?" * len(keys))
+        # Uploaded ones only count for OUTBOX_DEDUP_TTL, whether or not they were purged yet
+        row = self._db.execute(
+            f"SELECT planting_id FROM fingerprints WHERE key IN ({placeholders}) "
+            "AND (status != 'uploaded' OR created_at > ?) LIMIT 1",
+            (*keys, time.time() - OUTBOX_DEDUP_TTL),
+        ).fetchone()
+        return row["planting_id"] if row else None
+
+    def _purge_fingerprints(self):
+        with self._db:
+            self._db.execute(
+                "DELETE FROM fingerprints WHERE status = 'uploaded' AND created_at <= ?", (time.time() - OUTBOX_DEDUP_TTL,)
+            )
+        self._purged_at = time.monotonic()
+
+    async def _save(self, user_id, chat_id, token, data, chunks, file_unique_id=None, claim=False):
+        place = _place(data)
+        keys = [f"file:{file_unique_id}:{place}"] if file_unique_id else []
+        if keys and (earlier := self._duplicate(keys)) is not None:
+            # Known file, don't even download it
+            await chunks.aclose()
+            return "duplicate", earlier
+
+        tmp_path = os.path.join(self._photo_dir, f"planting-{time.time_ns()}.jpg")
+        size = 0
+        digest = hashlib.sha256()
+        try:
+            # The disk is written from a thread, a slow one mustn't hold up everyone else's updates
+            f = await asyncio.to_thread(open, tmp_path, "wb")
+            with f:
+                async for chunk in chunks:
+                    await asyncio.to_thread(f.write, chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                await asyncio.to_thread(_sync, f)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        content_key = f"content:{digest.hexdigest()}:{place}"
+        if (earlier := self._duplicate([content_key])) is not None:
+            os.remove(tmp_path)
+            return "duplicate", earlier
+        keys.append(content_key)
+
+        now = time.time()
+        with self._db:
+            cur = self._db.execute(
+                "INSERT INTO plantings (user_id, chat_id, token, data, photo_path, file_size, idempotency_key, "
+                "next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, chat_id, token, json.dumps(data), tmp_path, size,
+                 hashlib.sha256(content_key.encode()).hexdigest(), now, now),
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO fingerprints (key, planting_id, status, created_at) VALUES (?, ?, 'pending', ?)",
+                [(key, cur.lastrowid, now) for key in keys],
+            )
+        self._pending += 1
+        if claim:
+            self._claimed.add(cur.lastrowid)
+        elif self._wakeup is not None:
+            self._wakeup.set()
+        return "queued", cur.lastrowid
+
+    def pending_count(self):
+        return self._pending
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._dispatch())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Anything in flight stays pending on disk and is picked up on the next start
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def close(self):
+        self._db.close()
+
+    async def _dispatch(self):
+        while True:
+            if time.monotonic() - self._purged_at >= FINGERPRINT_PURGE_INTERVAL:
+                self._purge_fingerprints()
+            now = time.time()
+            rows = self._db.execute(
+                "SELECT * FROM plantings WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, self.workers * 4),
+            ).fetchall()
+            for row in rows:
+                if row["id"] not in self._claimed:
+                    self._claimed.add(row["id"])
+                    self._queue.put_nowait(row)
+            next_due = self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM plantings WHERE status = 'pending'"
+            ).fetchone()[0]
+            delay = 60.0 if next_due is None else max(0.0, min(60.0, next_due - time.time()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0.5))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self):
+        while True:
+            row = await self._queue.get()
+            try:
+                with correlation(f"planting-{row['id']}"):
+                    await self._upload(row)
+            except Exception as e:
+                logger.error(f"Uploading planting {row['id']} failed: {e}", exc_info=True, extra={"event": "outbox.error"})
+                # Back off like after any other failure, so a lasting error doesn't spin
+                try:
+                    self._retry(row, f"{type(e).__name__}: {e}")
+                except Exception:
+                    pass
+            finally:
+                self._claimed.discard(row["id"])
+                self._queue.task_done()
+
+    async def _upload(self, row, notify=True):
+        """Tries one upload. Returns ("uploaded", result), ("rejected", reason) or ("queued", id)."""
+        token = (self.token_lookup and self.token_lookup(row["user_id"])) or row["token"]
+        data = json.loads(row["data"])
+        try:
+            response = await self.api.upload_planting(
+                token, data, self.api.iter_file(row["photo_path"]), row["file_size"],
+                idempotency_key=row["idempotency_key"],
+            )
+        except (httpx.HTTPError, OSError) as e:
+            self._retry(row, str(e))
+            return "queued", row["id"]
+        if response.is_success:
+            self._finish(row)
+            try:
+                result = response.json()
+            except ValueError:
+                result = {}
+            if notify:
+                await self._notify(row, result)
+            return "uploaded", result
+        elif _is_permanent(response.status_code) or (
+            response.status_code in AUTH_STATUSES and time.time() - row["created_at"] >= OUTBOX_AUTH_WAIT
+        ):
+            logger.warning(f"Planting {row['id']} rejected: {response.status_code} {response.text}", extra={"event": "outbox.rejected"})
+            self._fail(row, response.text)
+            if notify:
+                await self._notify(row, None)
+            return "rejected", response.text[:200]
+        elif response.status_code in AUTH_STATUSES:
+            self._retry(row, f"HTTP {response.status_code}, waiting for the user to log in again")
+            return "queued", row["id"]
+        else:
+            self._retry(row, f"HTTP {response.status_code}")
+            return "queued", row["id"]
+
+    def _retry(self, row, error):
+        attempts = row["attempts"] + 1
+        delay = min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * 2 ** (attempts - 1))
+        delay = random.uniform(delay / 2, delay)
+        logger.warning(
+            f"Planting {row['id']} upload failed ({error}), retry {attempts} in {delay:.0f}s", extra={"event": "outbox.retry"},
+        )
+        with self._db:
+            self._db.execute(
+                "UPDATE plantings SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + delay, error[:1000], row["id"]),
+            )
+
+    def _fail(self, row, error):
+        with self._db:
+            self._db.execute(
+                "UPDATE plantings SET status = 'failed', last_error = ? WHERE id = ?", (error[:1000], row["id"]),
+            )
+            # Let the worker send it again once the bucket or permission is sorted out
+            self._db.execute("DELETE FROM fingerprints WHERE planting_id = ?", (row["id"],))
+        self._pending -= 1
+        # The row is kept for the record, the photo isn't needed any more
+        _remove_photo(row["photo_path"])
+
+    def retry_user(self, user_id):
+        """Makes the user's pending submissions due now, e.g. after they logged in with a fresh token."""
+        with self._db:
+            self._db.execute(
+                "UPDATE plantings SET next_attempt_at = ? WHERE user_id = ? AND status = 'pending'",
+                (time.time(), user_id),
+            )
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _finish(self, row):
+        with self._db:
+            self._db.execute("DELETE FROM plantings WHERE id = ?", (row["id"],))
+            self._db.execute(
+                "UPDATE fingerprints SET status = 'uploaded', created_at = ? WHERE planting_id = ?",
+                (time.time(), row["id"]),
+            )
+        self._pending -= 1
+        _remove_photo(row["photo_path"])
+
+    async def _notify(self, row, result):
+        if self.on_done is None:
+            return
+        try:
+            await self.on_done(row, result)
+        except Exception as e:
+            logger.error(f"Outbox notification failed: {e}", exc_info=True, extra={"event": "outbox.notify"})
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import sqlite3
+from telegram.ext import BasePersistence, PersistenceInput
+from config import STATE_STORE, STATE_DB_PATH, STATE_FLUSH_INTERVAL
+
+def _stored(key):
+    # Passwords typed into the register flow stay in memory only
+    return "password" not in key
+
+class SqlitePersistence(BasePersistence):
+    """Keeps conversation states and user_data in SQLite across restarts.
+
+    The Application hands over only the users and conversations that changed,
+    every `update_interval` seconds. user_data is stored one row per key and
+    compared with what is already on disk, so only changed keys are written.
+    All writes from one run land in a single transaction. Values must be JSON
+    serializable; chat_data, bot_data and callback_data are not stored, and
+    neither are user_data keys naming a password.
+    """
+
+    def __init__(self, path, update_interval=5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS user_data ("
+            "user_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (user_id, key))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "name TEXT NOT NULL, key TEXT NOT NULL, state TEXT NOT NULL, PRIMARY KEY (name, key))"
+        )
+        # Written by versions that still stored them
+        self._db.execute("DELETE FROM user_data WHERE key LIKE '%password%'")
+        self._db.commit()
+        # user_id -> {key: JSON value} as last written, to diff against
+        self._user_data = {}
+        for user_id, key, value in self._db.execute("SELECT user_id, key, value FROM user_data"):
+            self._user_data.setdefault(user_id, {})[key] = value
+        # Writes staged until the end of the current update run
+        self._upserts = {}
+        self._deletes = set()
+        self._conversations = {}
+        self._commit_scheduled = False
+
+    async def get_user_data(self):
+        return {
+            user_id: {key: json.loads(value) for key, value in data.items()}
+            for user_id, data in self._user_data.items()
+        }
+
+    async def update_user_data(self, user_id, data):
+        stored = self._user_data.setdefault(user_id, {})
+        for key, value in data.items():
+            if not _stored(key):
+                continue
+            encoded = json.dumps(value)
+            if stored.get(key) != encoded:
+                stored[key] = encoded
+                self._upserts[(user_id, key)] = encoded
+                self._deletes.discard((user_id, key))
+        for key in [k for k in stored if k not in data or not _stored(k)]:
+            del stored[key]
+            self._upserts.pop((user_id, key), None)
+            self._deletes.add((user_id, key))
+        self._schedule_commit()
+
+    async def drop_user_data(self, user_id):
+        for key in self._user_data.pop(user_id, {}):
+            self._upserts.pop((user_id, key), None)
+            self._deletes.add((user_id, key))
+        self._schedule_commit()
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def get_conversations(self, name):
+        rows = self._db.execute("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        self._conversations[(name, json.dumps(list(key)))] = new_state
+        self._schedule_commit()
+
+    def _schedule_commit(self):
+        # The Application issues all updates of one run back to back, commit them together
+        if not self._commit_scheduled:
+            self._commit_scheduled = True
+            asyncio.get_running_loop().call_soon(self._commit)
+
+    def _commit(self):
+        self._commit_scheduled = False
+        upserts, self._upserts = self._upserts, {}
+        deletes, self._deletes = self._deletes, set()
+        conversations, self._conversations = self._conversations, {}
+        if not (upserts or deletes or conversations):
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO user_data (user_id, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id, key) DO UPDATE SET value = excluded.value",
+                [(user_id, key, value) for (user_id, key), value in upserts.items()],
+            )
+            self._db.executemany("DELETE FROM user_data WHERE user_id = ? AND key = ?", list(deletes))
+            self._db.executemany(
+                "INSERT INTO conversations (name, key, state) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state",
+                [(name, key, json.dumps(state)) for (name, key), state in conversations.items() if state is not None],
+            )
+            self._db.executemany(
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                [(name, key) for (name, key), state in conversations.items() if state is None],
+            )
+
+    async def flush(self):
+        self._commit()
+
+    def close(self):
+        self._commit()
+        self._db.close()
+
+    # Not stored, see store_data
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+def create_persistence():
+    """Returns the configured persistence, or None to keep conversations in memory only."""
+    if STATE_STORE == "memory":
+        return None
+    return SqlitePersistence(STATE_DB_PATH, STATE_FLUSH_INTERVAL)
@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from metrics import OUTGOING_QUEUED, OUTGOING_RETRY_AFTER
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, lower goes first. Pick one with the priority() decorator or
+# send_priority(), or pass it as `rate_limit_args` to a context.bot method.
+INTERACTIVE, NORMAL, BULK = 0, 1, 2
+LANE_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BULK: "bulk"}
+
+# Bot API calls are made from the handler's own task, so the lane can follow the
+# handler without threading it through Message.reply_text and friends
+_current_lane = contextvars.ContextVar("send_lane", default=NORMAL)
+
+@contextlib.contextmanager
+def send_priority(lane):
+    """Messages sent inside the block go through `lane`."""
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+def priority(lane):
+    """Handler decorator: messages sent while the handler runs go through `lane`."""
+    def decorator(callback):
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            with send_priority(lane):
+                return await callback(update, context)
+        return wrapper
+    return decorator
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Takes a token if one is available, otherwise returns how long to wait for one."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def idle(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """Schedules outgoing Bot API calls under Telegram's flood limits.
+
+    Every call that targets a chat first waits for that chat's token bucket (private
+    chats and groups have separate rates), in the order it was made. It then waits
+    for the global bucket, where queued calls are served by lane, INTERACTIVE before
+    NORMAL before BULK. Calls without a chat_id (answerCallbackQuery, getFile, ...)
+    are not limited. On RetryAfter all sending pauses for the requested time and the
+    call is retried.
+    """
+
+    def __init__(self, overall_rate=30, chat_rate=1, chat_burst=3, group_rate=20 / 60, group_burst=3, max_retries=3):
+        # A cluster worker's share of the rate can be below 1/s, a burst below 1 would never send
+        self.overall = TokenBucket(overall_rate, max(overall_rate, 1))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        # chat_id -> (bucket, lock keeping that chat's calls in order)
+        self._chats = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._paused_until = 0.0
+        self._dispatcher = None
+
+    async def initialize(self):
+        # Called by both the bot and the updater
+        if self._dispatcher is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+    def queued(self, lane=None):
+        return sum(1 for entry in self._heap if lane is None or entry[0] == lane)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        lane = _current_lane.get() if rate_limit_args is None else rate_limit_args
+
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            await self._wait_for_turn(lane)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                OUTGOING_RETRY_AFTER.inc()
+                if attempt == self.max_retries:
+                    raise
+                delay = e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+                logger.warning(f"Flood limit hit on {endpoint} for {chat_id}, pausing {delay}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return None
+
+    def _chat(self, chat_id):
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            if len(self._chats) > 10000:
+                # Forget chats that have been quiet long enough to refill
+                for key in [k for k, (bucket, lock) in self._chats.items() if bucket.idle() and not lock.locked()]:
+                    del self._chats[key]
+            try:
+                is_group = int(chat_id) < 0
+            except (TypeError, ValueError):
+                # @channelusername
+                is_group = True
+            bucket = TokenBucket(self.group_rate, self.group_burst) if is_group else TokenBucket(self.chat_rate, self.chat_burst)
+            entry = self._chats[chat_id] = (bucket, asyncio.Lock())
+        return entry
+
+    async def _wait_for_chat(self, chat_id):
+        bucket, lock = self._chat(chat_id)
+        async with lock:
+            while (delay := bucket.take()) > 0:
+                await asyncio.sleep(delay)
+
+    async def _wait_for_turn(self, lane):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (lane, next(self._seq), future))
+        OUTGOING_QUEUED.labels(LANE_NAMES.get(lane, str(lane))).inc()
+        self._wakeup.set()
+        try:
+            await future
+        finally:
+            OUTGOING_QUEUED.labels(LANE_NAMES.get(lane, str(lane))).dec()
+
+    async def _dispatch(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            delay = self.overall.take()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            # Pop the highest priority caller that is still waiting
+            while self._heap:
+                _, _, future = heapq.heappop(self._heap)
+                if not future.done():
+                    future.set_result(None)
+                    break
@@ -0,0 +1,145 @@
+import math
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+from config import FRONTEND_URL, PRODUCTS_PAGE_SIZE
+
+LOCALES = ("en", "uz", "ru")
+DEFAULT_LOCALE = "en"
+
+STRINGS = {
+    "en": {
+        "login": "Login", "register": "Register", "logout": "Logout", "profile": "Profile",
+        "products": "Products", "cart": "My Cart", "app": "Open Novda App",
+        "tips": "Tips", "pricing": "Pricing", "plant": "Worker: Plant Tree", "plant_batch": "Worker: Batch Planting",
+        "welcome": "Hello {name}! Welcome to Novda Bot.\nStatus: {status}\n\nUse the menu below:",
+        "logged_in": "✅ Logged In", "logged_out": "❌ Not Logged In",
+        "price": "Price", "add": "Add {name} to Cart", "prev": "◀️ Prev", "next": "Next ▶️",
+        "no_products": "No products found.",
+        "cart_title": "🛒 *Your Cart*", "cart_empty": "Your cart is empty.", "total": "Total", "checkout": "Checkout",
+        "tree": "Tree",
+        "busy": "The bot is busy, please try again in a moment.", "slow_down": "Too many requests, please slow down.",
+    },
+    "uz": {
+        "login": "Kirish", "register": "Ro'yxatdan o'tish", "logout": "Chiqish", "profile": "Profil",
+        "products": "Mahsulotlar", "cart": "Savatim", "app": "Novda ilovasini ochish",
+        "tips": "Maslahatlar", "pricing": "Narxlar", "plant": "Ishchi: Daraxt ekish", "plant_batch": "Ishchi: Ko'plab ekish",
+        "welcome": "Salom {name}! Novda botiga xush kelibsiz.\nHolat: {status}\n\nQuyidagi menyudan foydalaning:",
+        "logged_in": "✅ Tizimga kirgansiz", "logged_out": "❌ Tizimga kirmagansiz",
+        "price": "Narxi", "add": "{name} — savatga qo'shish", "prev": "◀️ Oldingi", "next": "Keyingi ▶️",
+        "no_products": "Mahsulotlar topilmadi.",
+        "cart_title": "🛒 *Savatingiz*", "cart_empty": "Savatingiz bo'sh.", "total": "Jami", "checkout": "Buyurtma berish",
+        "tree": "Daraxt",
+        "busy": "Bot band, birozdan so'ng qayta urinib ko'ring.", "slow_down": "Juda ko'p so'rov, iltimos sekinroq.",
+    },
+    "ru": {
+        "login": "Войти", "register": "Регистрация", "logout": "Выйти", "profile": "Профиль",
+        "products": "Товары", "cart": "Моя корзина", "app": "Открыть приложение Novda",
+        "tips": "Советы", "pricing": "Цены", "plant": "Работник: посадить дерево", "plant_batch": "Работник: пакетная посадка",
+        "welcome": "Здравствуйте, {name}! Добро пожаловать в Novda Bot.\nСтатус: {status}\n\nВыберите действие в меню:",
+        "logged_in": "✅ Вы вошли", "logged_out": "❌ Вы не вошли",
+        "price": "Цена", "add": "Добавить {name} в корзину", "prev": "◀️ Назад", "next": "Далее ▶️",
+        "no_products": "Товары не найдены.",
+        "cart_title": "🛒 *Ваша корзина*", "cart_empty": "Ваша корзина пуста.", "total": "Итого", "checkout": "Оформить заказ",
+        "tree": "Дерево",
+        "busy": "Бот перегружен, попробуйте ещё раз чуть позже.", "slow_down": "Слишком много запросов, помедленнее.",
+    },
+}
+
+def locale_of(user):
+    """Picks the locale from the user's Telegram language_code ("ru", "uz-UZ", ...), English otherwise."""
+    code = ((user.language_code if user else None) or "").split("-")[0].lower()
+    return code if code in STRINGS else DEFAULT_LOCALE
+
+def text(locale, key, **kwargs):
+    s = STRINGS[locale][key]
+    return s.format(**kwargs) if kwargs else s
+
+def _main_menu(locale, logged_in):
+    t = STRINGS[locale]
+    keyboard = []
+    if not logged_in:
+        keyboard.append([InlineKeyboardButton(t["login"], callback_data="login"), InlineKeyboardButton(t["register"], callback_data="register")])
+    else:
+        keyboard.append([InlineKeyboardButton(t["logout"], callback_data="logout"), InlineKeyboardButton(t["profile"], callback_data="profile")])
+    keyboard.append([InlineKeyboardButton(t["products"], callback_data="products"), InlineKeyboardButton(t["cart"], callback_data="cart")])
+    keyboard.append([InlineKeyboardButton(t["app"], web_app=WebAppInfo(url=FRONTEND_URL))])
+    keyboard.append([InlineKeyboardButton(t["tips"], callback_data="tips"), InlineKeyboardButton(t["pricing"], callback_data="pricing")])
+    # Worker status isn't known without a /me call, so any logged in user gets the button
+    # and the backend refuses the planting if they lack the permission
+    if logged_in:
+        keyboard.append([InlineKeyboardButton(t["plant"], callback_data="plant_tree")])
+        keyboard.append([InlineKeyboardButton(t["plant_batch"], callback_data="plant_batch")])
+    return InlineKeyboardMarkup(keyboard)
+
+# (locale, logged_in) -> keyboard, built once
+MAIN_MENUS = {(locale, logged_in): _main_menu(locale, logged_in) for locale in LOCALES for logged_in in (False, True)}
+CHECKOUT_MARKUP = {locale: InlineKeyboardMarkup([[InlineKeyboardButton(text(locale, "checkout"), callback_data="checkout")]]) for locale in LOCALES}
+
+def main_menu(locale, logged_in):
+    return MAIN_MENUS[(locale, bool(logged_in))]
+
+def product_name(product, locale):
+    tree = product.get('tree', {})
+    return tree.get(f'name_{locale}') or tree.get('name_en') or text(locale, "tree")
+
+def product_description(product, locale):
+    tree = product.get('tree', {})
+    return tree.get(f'desc_{locale}') or tree.get('desc_en', '')
+
+def product_fragment(product, locale, name=None):
+    """The product's entry in catalog messages, in Markdown."""
+    name = name or product_name(product, locale)
+    return f"🌳 *{name}*\n{text(locale, 'price')}: ${product.get('price', '0')}\n{product_description(product, locale)}"
+
+def add_button(product, locale, name=None):
+    name = name or product_name(product, locale)
+    return InlineKeyboardButton(text(locale, "add", name=name), callback_data=f"add_{product['id']}")
+
+class CatalogView:
+    """Catalog messages for every locale, rendered once per catalog load.
+
+    Register rebuild() as a CatalogCache listener; the product browser then
+    only looks pages up with page().
+    """
+
+    def __init__(self):
+        # locale -> [(text, keyboard)] per page
+        self._pages = {locale: [] for locale in LOCALES}
+        # locale -> {product id: name}
+        self._names = {locale: {} for locale in LOCALES}
+
+    def rebuild(self, products):
+        for locale in LOCALES:
+            fragments = []
+            names = {}
+            for p in products:
+                name = product_name(p, locale)
+                names[p['id']] = name
+                fragments.append((product_fragment(p, locale, name), [add_button(p, locale, name)]))
+            self._names[locale] = names
+            self._pages[locale] = self._paginate(locale, fragments)
+
+    def _paginate(self, locale, fragments):
+        t = STRINGS[locale]
+        pages = max(1, math.ceil(len(fragments) / PRODUCTS_PAGE_SIZE))
+        rendered = []
+        for page in range(pages):
+            chunk = fragments[page * PRODUCTS_PAGE_SIZE:(page + 1) * PRODUCTS_PAGE_SIZE]
+            keyboard = [button for _, button in chunk]
+            if pages > 1:
+                nav = []
+                if page > 0:
+                    nav.append(InlineKeyboardButton(t["prev"], callback_data=f"products_page_{page - 1}"))
+                nav.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"products_page_{page}"))
+                if page < pages - 1:
+                    nav.append(InlineKeyboardButton(t["next"], callback_data=f"products_page_{page + 1}"))
+                keyboard.append(nav)
+            rendered.append(("\n\n".join(fragment for fragment, _ in chunk), InlineKeyboardMarkup(keyboard)))
+        return rendered
+
+    def page(self, locale, page):
+        """Returns (text, keyboard) for a page, clamped to the pages there are."""
+        pages = self._pages[locale]
+        return pages[min(max(page, 0), len(pages) - 1)]
+
+    def name(self, product, locale):
+        return self._names[locale].get(product.get('id')) or product_name(product, locale)
@@ -0,0 +1,146 @@
+import re
+from collections import OrderedDict
+from telegram import InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from rendering import LOCALES, STRINGS, add_button, product_description, product_fragment, product_name
+
+WORD = re.compile(r"\w+")
+# Words are indexed by their prefixes up to this length; longer query words are cut to it
+MAX_PREFIX = 24
+# Ranks of a match, lower comes first
+NAME_RANK, DESC_RANK = 0, 1
+
+def words(s):
+    return WORD.findall(s.casefold())
+
+class CatalogSearch:
+    """Prefix index over product names and descriptions in every locale, for inline search.
+
+    Each word of a product's tree name_*/desc_* fields is indexed by all of its
+    prefixes, so a query is one dict lookup per query word plus an intersection.
+    Products are ranked by where the words matched (names before descriptions),
+    then by catalog order. Register update() as a CatalogCache listener: it
+    reindexes only the products that changed. Answers are kept per (locale, query)
+    in an LRU cache, emptied whenever the catalog changes.
+    """
+
+    def __init__(self, page_size=20, cache_size=2000):
+        self.page_size = page_size
+        self.cache_size = cache_size
+        # product id -> product
+        self._products = {}
+        # product id -> position in the catalog
+        self._order = {}
+        # prefix -> {product id: rank}
+        self._prefixes = {}
+        # product id -> {prefix: rank} it was indexed under, to unindex it
+        self._indexed = {}
+        # (locale, product id) -> InlineQueryResultArticle, built on first use
+        self._results = {}
+        # (locale, normalized query) -> [InlineQueryResultArticle]
+        self._answers = OrderedDict()
+
+    def __len__(self):
+        return len(self._products)
+
+    def update(self, products):
+        """Makes the index hold exactly `products`, touching only the ones that changed."""
+        seen = set()
+        changed = False
+        for position, product in enumerate(products):
+            product_id = product['id']
+            seen.add(product_id)
+            if self._order.get(product_id) != position:
+                self._order[product_id] = position
+                changed = True
+            if self._products.get(product_id) != product:
+                self._remove(product_id)
+                self._add(product)
+                changed = True
+        for product_id in [p for p in self._products if p not in seen]:
+            self._remove(product_id)
+            del self._order[product_id]
+            changed = True
+        if changed:
+            self._answers.clear()
+
+    def _add(self, product):
+        product_id = product['id']
+        prefixes = {}
+        tree = product.get('tree', {})
+        for locale in LOCALES:
+            for field, rank in ((f'name_{locale}', NAME_RANK), (f'desc_{locale}', DESC_RANK)):
+                for word in words(tree.get(field) or ''):
+                    for end in range(1, min(len(word), MAX_PREFIX) + 1):
+                        prefix = word[:end]
+                        if prefixes.get(prefix, rank + 1) > rank:
+                            prefixes[prefix] = rank
+        for prefix, rank in prefixes.items():
+            self._prefixes.setdefault(prefix, {})[product_id] = rank
+        self._indexed[product_id] = prefixes
+        self._products[product_id] = product
+
+    def _remove(self, product_id):
+        for prefix in self._indexed.pop(product_id, {}):
+            members = self._prefixes[prefix]
+            del members[product_id]
+            if not members:
+                del self._prefixes[prefix]
+        self._products.pop(product_id, None)
+        for locale in LOCALES:
+            self._results.pop((locale, product_id), None)
+
+    def search(self, query):
+        """Ids of the products matching every word of `query`, best first. An empty query matches all."""
+        query_words = [word[:MAX_PREFIX] for word in words(query)]
+        if not query_words:
+            return sorted(self._products, key=self._order.__getitem__)
+        hits = []
+        for word in query_words:
+            members = self._prefixes.get(word)
+            if not members:
+                return []
+            hits.append(members)
+        hits.sort(key=len)
+        scores = {}
+        for product_id, rank in hits[0].items():
+            for members in hits[1:]:
+                other = members.get(product_id)
+                if other is None:
+                    break
+                rank += other
+            else:
+                scores[product_id] = rank
+        return sorted(scores, key=lambda product_id: (scores[product_id], self._order[product_id]))
+
+    def answer(self, locale, query):
+        """All inline results for a query, from the cache when it was asked before."""
+        key = (locale, " ".join(words(query)))
+        results = self._answers.get(key)
+        if results is not None:
+            self._answers.move_to_end(key)
+            return results
+        results = [self._result(locale, product_id) for product_id in self.search(query)]
+        self._answers[key] = results
+        if len(self._answers) > self.cache_size:
+            self._answers.popitem(last=False)
+        return results
+
+    def page(self, locale, query, offset=0):
+        """Returns (results, next_offset) for one page; next_offset is "" on the last page."""
+        results = self.answer(locale, query)
+        end = offset + self.page_size
+        return results[offset:end], str(end) if end < len(results) else ""
+
+    def _result(self, locale, product_id):
+        result = self._results.get((locale, product_id))
+        if result is None:
+            product = self._products[product_id]
+            name = product_name(product, locale)
+            result = self._results[(locale, product_id)] = InlineQueryResultArticle(
+                id=str(product_id),
+                title=name,
+                description=f"{STRINGS[locale]['price']}: ${product.get('price', '0')}\n{product_description(product, locale)}",
+                input_message_content=InputTextMessageContent(product_fragment(product, locale, name), parse_mode='Markdown'),
+                reply_markup=InlineKeyboardMarkup([[add_button(product, locale, name)]]),
+            )
+        return result
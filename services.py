@@ -1,180 +1,570 @@
-import requests
-from config import BACKEND_URL
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+import httpx
+from breaker import CircuitBreaker
+from metrics import BACKEND_LATENCY, BACKEND_IN_FLIGHT, BACKEND_DEDUPED, BACKEND_RETRIES
+from config import (
+    BACKEND_URL, BACKEND_TIMEOUT, BACKEND_CONNECT_TIMEOUT, BACKEND_ENDPOINT_TIMEOUTS,
+    BACKEND_MAX_CONNECTIONS, BACKEND_MAX_CONCURRENCY,
+    BACKEND_GET_RETRIES, BACKEND_RETRY_BASE, BACKEND_BREAKER_THRESHOLD, BACKEND_BREAKER_RESET,
+    CATALOG_TTL, CATALOG_SNAPSHOT_PATH, BUCKETS_TTL, UPLOAD_CHUNK_SIZE, USER_CACHE_TTL, USER_CACHE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+class CatalogCache:
+    """In-process product catalog cache with stale-while-revalidate.
+
+    Fresh data is returned straight from memory. Once the TTL has passed the
+    stale catalog is still returned, while a single background task refreshes it.
+    Only a cold cache makes the caller wait for the backend. Callables in
+    `listeners` are called with the new catalog after every successful load.
+
+    With a `snapshot_path` the last good catalog is also kept on disk, and
+    load_snapshot() serves it (as stale) right after a restart, before the
+    backend has answered or even while it is down.
+    """
+
+    def __init__(self, loader, ttl, snapshot_path=None):
+        self._loader = loader
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.listeners = []
+        self._products = None
+        self._loaded_at = 0.0
+        self._refresh_task = None
+        self._snapshot = None
+
+    def is_fresh(self):
+        return self._products is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def get(self):
+        if self._products is None:
+            # Cold cache: everyone waits on the same load
+            await asyncio.shield(self.refresh())
+        elif not self.is_fresh():
+            self.refresh()
+        return self._products or []
+
+    def refresh(self):
+        """Starts a background refresh unless one is already running and returns its task."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._load())
+        return self._refresh_task
+
+    def invalidate(self, drop=False):
+        """Marks the catalog stale so the next read refreshes it.
+
+        With drop=True the cached data is discarded as well and the next read waits for the backend.
+        """
+        self._loaded_at = 0.0
+        if drop:
+            self._products = None
+
+    async def _load(self):
+        products = await self._loader()
+        # On failure keep serving whatever we had
+        if products is not None:
+            self.put(products)
+
+    def put(self, products):
+        """Stores a catalog loaded outside the cache as if it had just been refreshed."""
+        self._set(products)
+        self._loaded_at = time.monotonic()
+        self._save_snapshot(products)
+
+    def _set(self, products):
+        for listener in self.listeners:
+            listener(products)
+        self._products = products
+
+    def load_snapshot(self):
+        """Serves the catalog saved by the last run until the backend answers. Returns True if there was one."""
+        if self.snapshot_path is None or self._products is not None:
+            return False
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                self._snapshot = f.read()
+            products = json.loads(self._snapshot)
+        except (OSError, ValueError):
+            return False
+        # Left stale, so the first read also starts a refresh
+        self._set(products)
+        return True
+
+    def _save_snapshot(self, products):
+        if self.snapshot_path is None:
+            return
+        data = json.dumps(products, separators=(",", ":"), ensure_ascii=False).encode()
+        if data == self._snapshot:
+            return
+        # Written aside and renamed, so a crash never leaves a torn snapshot
+        tmp = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            if os.path.dirname(self.snapshot_path):
+                os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.snapshot_path)
+            self._snapshot = data
+        except OSError as e:
+            logger.warning(f"Saving catalog snapshot failed: {e}", extra={"event": "catalog.snapshot"})
+
+# Responses that mean the backend (or the proxy in front of it) is in trouble
+UNAVAILABLE_STATUSES = (502, 503, 504)
+
+# What a backend call can fail with: transport and HTTP errors, and ValueError from
+# response.json() when a response carries something else (e.g. a proxy's HTML error page)
+BACKEND_ERRORS = (httpx.HTTPError, ValueError)
+
+def backend_down(error):
+    """True if the error means the backend could not answer, not that it refused the request."""
+    return not isinstance(error, httpx.HTTPStatusError) or error.response.status_code >= 500
+
+class UserCache:
+    """Per-user cache of read responses (profile, cart), keyed by access token.
+
+    Entries expire after `ttl` seconds as a fallback, but are normally dropped by
+    invalidate() from our own write paths. A read started before an invalidation
+    is not stored, so a write is never followed by a stale view. Expired entries
+    are kept until evicted, to be served with stale=True while the backend is down.
+    """
+
+    _generations = itertools.count(1)
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        # token -> {"gen": int, "values": {name: (expires_at, value)}}
+        self._entries = OrderedDict()
+
+    def generation(self, token):
+        entry = self._entries.get(token)
+        return entry["gen"] if entry else 0
+
+    def get(self, token, name, stale=False):
+        entry = self._entries.get(token)
+        if entry is None or name not in entry["values"]:
+            return None
+        expires_at, value = entry["values"][name]
+        if expires_at <= time.monotonic() and not stale:
+            return None
+        self._entries.move_to_end(token)
+        return value
+
+    def set(self, token, name, value, generation):
+        if generation != self.generation(token):
+            return
+        entry = self._entries.get(token)
+        if entry is None:
+            entry = self._entries[token] = {"gen": 0, "values": {}}
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(token)
+        entry["values"][name] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, token, *names):
+        """Drops the given cached responses for the user, or all of them if no names are given."""
+        entry = self._entries.get(token)
+        if entry is None:
+            entry = self._entries[token] = {"gen": 0, "values": {}}
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        entry["gen"] = next(self._generations)
+        for name in names or list(entry["values"]):
+            entry["values"].pop(name, None)
+
+def multipart_envelope(boundary, data, field, filename, content_type):
+    """Returns the (head, tail) bytes that wrap the file part of a multipart/form-data body."""
+    head = "".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'
+        for key, value in data.items()
+    )
+    head += (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'
+    )
+    return head.encode(), f'\r\n--{boundary}--\r\n'.encode()
+
+async def iter_multipart(head, tail, chunks):
+    """Yields a multipart body, passing the file part through from `chunks` as it arrives."""
+    yield head
+    async for chunk in chunks:
+        yield chunk
+    yield tail
 
 class ApiService:
-    def __init__(self):
+    """Async client for the Novda backend.
+
+    All calls go through one shared httpx.AsyncClient, so connections are kept
+    alive and reused, and a semaphore caps how many requests are in flight at once.
+    Failed GETs are retried with jittered backoff, and a circuit breaker fails
+    calls fast while the backend is down; reads then fall back to cached data.
+    """
+
+    def __init__(self, transport=None):
         self.base_url = BACKEND_URL
+        self.transport = transport
+        self._client = None
+        # Separate pool for pulling files from Telegram, so a streamed upload
+        # never waits on a backend connection for its own download
+        self._download_client = None
+        self._semaphore = asyncio.Semaphore(BACKEND_MAX_CONCURRENCY)
+        self.breaker = CircuitBreaker(BACKEND_BREAKER_THRESHOLD, BACKEND_BREAKER_RESET)
+        # (path, token) -> task of the GET currently in flight
+        self._inflight = {}
+        self.user_cache = UserCache(USER_CACHE_TTL, USER_CACHE_SIZE)
+        self.catalog = CatalogCache(self.fetch_products, CATALOG_TTL, CATALOG_SNAPSHOT_PATH)
+        # Ordered buckets waiting to be planted, shared by all workers. Refreshed with the
+        # token of the last worker who asked; tokens getOrders refused are remembered in user_cache
+        self.buckets = CatalogCache(self.fetch_ordered_buckets, BUCKETS_TTL)
+        self._worker_token = None
+
+    @property
+    def client(self):
+        # Created lazily so the client is bound to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=BACKEND_MAX_CONNECTIONS,
+                    max_keepalive_connections=BACKEND_MAX_CONNECTIONS,
+                ),
+                timeout=httpx.Timeout(BACKEND_TIMEOUT, connect=BACKEND_CONNECT_TIMEOUT),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._download_client is not None:
+            await self._download_client.aclose()
+            self._download_client = None
+
+    async def iter_file(self, file_path):
+        """Streams a Telegram file (URL or local Bot API path) in UPLOAD_CHUNK_SIZE chunks."""
+        if not file_path.startswith(("http://", "https://")):
+            # Local Bot API server files: read from a thread so a slow disk doesn't stall the event loop
+            f = await asyncio.to_thread(open, file_path, "rb")
+            with f:
+                while chunk := await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE):
+                    yield chunk
+            return
+        if self._download_client is None or self._download_client.is_closed:
+            self._download_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(BACKEND_TIMEOUT, connect=BACKEND_CONNECT_TIMEOUT),
+                transport=self.transport,
+            )
+        async with self._download_client.stream("GET", file_path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(UPLOAD_CHUNK_SIZE):
+                yield chunk
+
+    def _timeout(self, name):
+        read = BACKEND_ENDPOINT_TIMEOUTS.get(name, BACKEND_TIMEOUT)
+        return httpx.Timeout(read, connect=BACKEND_CONNECT_TIMEOUT)
+
+    async def _request(self, name, method, path, token=None, **kwargs):
+        """Sends one request to the backend and returns the response.
+
+        `name` is the ApiService method making the call; it picks the timeout.
+        Identical concurrent GETs (same path and token) share a single backend request.
+        Raises httpx.HTTPError on transport errors and breaker.BackendUnavailable
+        while the breaker is open, the caller decides on raise_for_status.
+        """
+        if method != "GET" or kwargs:
+            return await self._send(name, method, path, token, **kwargs)
+
+        key = (path, token)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._send(name, method, path, token))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.get(key) is done and self._inflight.pop(key))
+        else:
+            BACKEND_DEDUPED.labels(name).inc()
+        # Shielded so one caller giving up doesn't cancel the request for the others
+        return await asyncio.shield(task)
 
-    def login(self, username, password):
-        url = f"{self.base_url}/api/login/"
+    def invalidate_user(self, token, *names):
+        """Forgets cached and in-flight reads for the user after a write, see UserCache.invalidate."""
+        self.user_cache.invalidate(token, *names)
+        # Reads from now on must not join a GET that started before the write
+        for key in [k for k in self._inflight if k[1] == token]:
+            del self._inflight[key]
+
+    async def _send(self, name, method, path, token=None, **kwargs):
+        headers = kwargs.pop("headers", {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        # Only GETs are safe to repeat, a retried POST could add to the cart twice
+        retries = BACKEND_GET_RETRIES if method == "GET" else 0
+        for attempt in range(retries + 1):
+            if attempt:
+                BACKEND_RETRIES.labels(name).inc()
+                await asyncio.sleep(random.uniform(0, BACKEND_RETRY_BASE * 2 ** attempt))
+            self.breaker.check(name)
+            try:
+                response = await self._attempt(name, method, path, headers, **kwargs)
+            except httpx.TransportError:
+                self.breaker.failure()
+                if attempt == retries:
+                    raise
+                continue
+            if response.status_code not in UNAVAILABLE_STATUSES:
+                self.breaker.success()
+                return response
+            self.breaker.failure()
+        return response
+
+    async def _attempt(self, name, method, path, headers, **kwargs):
+        async with self._semaphore:
+            BACKEND_IN_FLIGHT.inc()
+            started = time.perf_counter()
+            status = "error"
+            try:
+                response = await self.client.request(method, path, headers=headers, timeout=self._timeout(name), **kwargs)
+                status = str(response.status_code)
+                return response
+            finally:
+                BACKEND_IN_FLIGHT.dec()
+                BACKEND_LATENCY.labels(name, status).observe(time.perf_counter() - started)
+
+    async def login(self, username, password):
         try:
-            response = requests.post(url, data={"username": username, "password": password})
+            response = await self._request("login", "POST", "/api/login/", data={"username": username, "password": password})
             response.raise_for_status()
             return response.json()
-        except requests.RequestException as e:
-            print(f"Login failed: {e}")
+        except BACKEND_ERRORS as e:
+            logger.warning(f"Login failed: {e}", extra={"event": "backend.login"})
             return None
 
-    def get_products(self):
-        url = f"{self.base_url}/api/products/"
+    async def get_products(self):
+        # Served from the catalog cache, see fetch_products for the backend call
+        return await self.catalog.get()
+
+    async def fetch_products(self):
         try:
-            response = requests.get(url)
+            response = await self._request("get_products", "GET", "/api/products/")
             response.raise_for_status()
             return response.json()
-        except requests.RequestException as e:
-            print(f"Get products failed: {e}")
-            return []
-
-    def get_product(self, product_id):
-        url = f"{self.base_url}/api/product/{product_id}/"
-        try:
-            response = requests.get(url) # This endpoint might need auth if guarded, but usually public details are public. checking view.. it says @permission_classes([IsAuthenticated]). Wait.
-            # views.py says @permission_classes([IsAuthenticated]) for getProductDetail.
-            # So I need a token for this!
-            # I'll update signature to accept token.
-            return None
-        except requests.RequestException:
+        except BACKEND_ERRORS as e:
+            logger.warning(f"Get products failed: {e}", extra={"event": "backend.get_products"})
             return None
-    
-    # Corrected method with token
-    def get_product_authenticated(self, product_id, token):
-        url = f"{self.base_url}/api/product/{product_id}/"
-        headers = {"Authorization": f"Bearer {token}"}
+
+    async def get_product(self, product_id):
+        # views.py says @permission_classes([IsAuthenticated]) for getProductDetail,
+        # so use get_product_authenticated instead.
+        return None
+
+    async def get_product_authenticated(self, product_id, token):
         try:
-            response = requests.get(url, headers=headers)
+            response = await self._request("get_product", "GET", f"/api/product/{product_id}/", token=token)
             response.raise_for_status()
             return response.json()
-        except requests.RequestException as e:
-            print(f"Get product failed: {e}")
+        except BACKEND_ERRORS as e:
+            logger.warning(f"Get product failed: {e}", extra={"event": "backend.get_product"})
             return None
 
-    def add_to_cart(self, token, product_id, count=1):
-        url = f"{self.base_url}/api/addToCart/"
-        headers = {"Authorization": f"Bearer {token}"}
+    async def add_to_cart(self, token, product_id, count=1):
         try:
-            response = requests.post(url, headers=headers, json={"product_id": product_id, "count": count})
+            response = await self._request("add_to_cart", "POST", "/api/addToCart/", token=token, json={"product_id": product_id, "count": count})
             response.raise_for_status()
             return response.json()
-        except requests.RequestException as e:
-             # Try to print response text for debugging
-            if hasattr(e, 'response') and e.response:
-                print(f"Add to cart error: {e.response.text}")
+        except BACKEND_ERRORS as e:
+            # Log the response text for debugging
+            if isinstance(e, httpx.HTTPStatusError):
+                logger.warning(f"Add to cart error: {e.response.text}", extra={"event": "backend.add_to_cart"})
+            else:
+                logger.warning(f"Add to cart failed: {e}", extra={"event": "backend.add_to_cart"})
             return None
+        finally:
+            # Also discards anything read while the write was in flight
+            self.invalidate_user(token, "get_my_trees")
 
-    def get_my_trees(self, token):
+    async def get_my_trees(self, token):
         # This is the cart/pending buckets
-        url = f"{self.base_url}/api/get/my/trees/"
-        headers = {"Authorization": f"Bearer {token}"}
+        cached = self.user_cache.get(token, "get_my_trees")
+        if cached is not None:
+            return cached
+        generation = self.user_cache.generation(token)
         try:
-            response = requests.get(url, headers=headers)
+            response = await self._request("get_my_trees", "GET", "/api/get/my/trees/", token=token)
             response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Get trees failed: {e}")
-            return []
+            items = response.json()
+            self.user_cache.set(token, "get_my_trees", items, generation)
+            return items
+        except BACKEND_ERRORS as e:
+            logger.warning(f"Get trees failed: {e}", extra={"event": "backend.get_my_trees"})
+            # Backend down: an outdated cart is more useful than an empty one
+            stale = self.user_cache.get(token, "get_my_trees", stale=True) if backend_down(e) else None
+            return stale if stale is not None else []
 
-    def checkout(self, token, payment_method="payme"):
-        url = f"{self.base_url}/api/checkout/"
-        headers = {"Authorization": f"Bearer {token}"}
+    async def checkout(self, token, payment_method="payme"):
         try:
-            response = requests.post(url, headers=headers, json={"payment_method": payment_method})
+            response = await self._request("checkout", "POST", "/api/checkout/", token=token, json={"payment_method": payment_method})
             response.raise_for_status()
             return response.json()
-        except requests.RequestException as e:
-            print(f"Checkout failed: {e}")
+        except BACKEND_ERRORS as e:
+            logger.warning(f"Checkout failed: {e}", extra={"event": "backend.checkout"})
             return None
+        finally:
+            self.invalidate_user(token)
 
-    def register(self, data):
-        url = f"{self.base_url}/register/"
+    async def register(self, data):
         try:
-            response = requests.post(url, data=data)
+            response = await self._request("register", "POST", "/register/", data=data)
             # 400 bad request is common for validation, so we want to return the json errors
             if response.status_code == 400:
-                print(f"Register validation error: {response.text}")
-                return response.json() 
+                logger.info(f"Register validation error: {response.text}", extra={"event": "backend.register"})
+                return response.json()
             response.raise_for_status()
             return response.json()
-        except requests.RequestException as e:
-            print(f"Register failed: {e}")
+        except BACKEND_ERRORS as e:
+            logger.warning(f"Register failed: {e}", extra={"event": "backend.register"})
             return None
 
-    def logout(self, token):
-        url = f"{self.base_url}/logout/"
-        headers = {"Authorization": f"Bearer {token}"}
+    async def logout(self, token):
+        self.invalidate_user(token)
         try:
-            requests.post(url, headers=headers)
+            await self._request("logout", "POST", "/logout/", token=token)
             return True
-        except requests.RequestException:
+        except httpx.HTTPError:
             return False
 
-    def update_cart_quantity(self, token, bucket_id, delta):
-        url = f"{self.base_url}/api/update/cart/"
-        headers = {"Authorization": f"Bearer {token}"}
+    async def update_cart_quantity(self, token, bucket_id, delta):
         try:
-            response = requests.post(url, headers=headers, json={"bucket_id": bucket_id, "delta": delta})
+            response = await self._request("update_cart_quantity", "POST", "/api/update/cart/", token=token, json={"bucket_id": bucket_id, "delta": delta})
             response.raise_for_status()
             return True
-        except requests.RequestException as e:
-            print(f"Update cart failed: {e}")
+        except httpx.HTTPError as e:
+            logger.warning(f"Update cart failed: {e}", extra={"event": "backend.update_cart_quantity"})
             return False
+        finally:
+            self.invalidate_user(token, "get_my_trees")
 
-    def remove_from_cart(self, token, bucket_id):
-        url = f"{self.base_url}/api/remove/cart/"
-        headers = {"Authorization": f"Bearer {token}"}
+    async def remove_from_cart(self, token, bucket_id):
         try:
-            response = requests.post(url, headers=headers, json={"bucket_id": bucket_id})
+            response = await self._request("remove_from_cart", "POST", "/api/remove/cart/", token=token, json={"bucket_id": bucket_id})
             response.raise_for_status()
             return True
-        except requests.RequestException as e:
-            print(f"Remove from cart failed: {e}")
+        except httpx.HTTPError as e:
+            logger.warning(f"Remove from cart failed: {e}", extra={"event": "backend.remove_from_cart"})
             return False
+        finally:
+            self.invalidate_user(token, "get_my_trees")
 
-    def get_my_orders(self, token):
-        # We need an endpoint for customer orders. 
-        # views.py has `getOrders` but it calls `WorkerBucketSerializer` on ALL ordered buckets?
-        # That seems like an admin/worker view. 
-        # Customer view might be missing or different.
-        # Let's check `getOrders` permissions in views.py... It effectively lists ALL ordered buckets.
-        # But `get_mytrees_info` lists PENDING buckets.
-        # There is no specific 'my history' endpoint in the urls/views for customer to see 'ordered' items specifically grouped by Order.
-        # But for now I will try to use a filter on `get_mytrees_info` if I could pass status?
-        # No, `get_mytrees_info` is hardcoded to `status="pending"`.
-        # I might need to rely on what is available. 
-        # Actually, `getOrders` is for workers/admin.
-        # Let's assume for now we can't easily get past orders specifically for the user without backend change, 
-        # OR we can try to filter `Bucket.objects.filter(user=profile)` in a new view?
-        # But I cannot change backend easily if I am just "using backend logic".
-        # Wait, I found `get_mytrees_info` gets buckets for user. 
-        # The user said "use all logics of backend". 
-        # I will stick to available endpoints.
-        # If no history endpoint, I will just show "Not available" or I will implement `plant_tree` basics.
-        # Let's add `plant_tree` which IS available for workers.
+    async def get_my_orders(self, token):
+        # There is no customer order history endpoint in the backend yet.
+        # `getOrders` lists ALL ordered buckets and is meant for workers/admin,
+        # and `get_mytrees_info` is hardcoded to `status="pending"`.
         return []
 
-    def plant_tree(self, token, data, files):
+    async def get_ordered_buckets(self, token):
+        """Ordered buckets, or None unless getOrders is known to accept `token`.
+
+        Served from the bucket cache, see fetch_ordered_buckets. Only workers may list
+        them, so a token is checked against the backend once before it sees the cache.
+        """
+        if not token:
+            return None
+        # Expired entries still count, the answer only changes when the token does
+        allowed = self.user_cache.get(token, "orders_access", stale=True)
+        if allowed is None:
+            generation = self.user_cache.generation(token)
+            buckets = await self._fetch_orders(token)
+            if buckets is None:
+                # Backend trouble, the token can't be checked now
+                return None
+            allowed = buckets is not False
+            self.user_cache.set(token, "orders_access", allowed, generation)
+            if allowed:
+                self.buckets.put(buckets)
+        if not allowed:
+            return None
+        self._worker_token = token
+        return await self.buckets.get()
+
+    async def fetch_ordered_buckets(self):
+        # Loader of the bucket cache
+        token = self._worker_token
+        if token is None:
+            return None
+        buckets = await self._fetch_orders(token)
+        if buckets is False:
+            # The worker's token expired or lost the permission
+            self.user_cache.set(token, "orders_access", False, self.user_cache.generation(token))
+            if self._worker_token == token:
+                self._worker_token = None
+            return None
+        return buckets
+
+    async def _fetch_orders(self, token):
+        """Returns the ordered buckets, False if `token` may not list them, or None on failure."""
+        try:
+            response = await self._request("get_ordered_buckets", "GET", "/api/get/orders/", token=token)
+            if response.status_code in (401, 403):
+                return False
+            response.raise_for_status()
+            return response.json()
+        except BACKEND_ERRORS as e:
+            logger.warning(f"Get ordered buckets failed: {e}", extra={"event": "backend.get_ordered_buckets"})
+            return None
+
+    async def plant_tree(self, token, data, files):
         # data = {'bucket': bucket_id, 'latitude': lat, 'longtitude': long, 'plantingDate': date}
         # files = {'images': open_file}
-        url = f"{self.base_url}/api/plant/tree/"
-        headers = {"Authorization": f"Bearer {token}"}
         try:
             # We don't send json here, we send multipart/form-data
-            # requests handles multipart if we pass `files` and `data`
-            response = requests.post(url, headers=headers, data=data, files=files)
+            # httpx handles multipart if we pass `files` and `data`
+            response = await self._request("plant_tree", "POST", "/api/plant/tree/", token=token, data=data, files=files)
             response.raise_for_status()
             return response.json()
-        except requests.RequestException as e:
-            print(f"Plant tree failed: {e}")
-            if hasattr(e, 'response') and e.response:
-                print(e.response.text)
+        except BACKEND_ERRORS as e:
+            details = f": {e.response.text}" if isinstance(e, httpx.HTTPStatusError) else ""
+            logger.warning(f"Plant tree failed: {e}{details}", extra={"event": "backend.plant_tree"})
             return None
 
-    def get_me(self, token):
-        url = f"{self.base_url}/api/get/me/"
-        headers = {"Authorization": f"Bearer {token}"}
+    async def upload_planting(self, token, data, chunks, file_size=None, filename="planted.jpg", idempotency_key=None):
+        """Streams a planting to /api/plant/tree/ and returns the raw response.
+
+        The photo is read from `chunks` as it is sent instead of being held in memory.
+        Pass `file_size` when known so the body gets a Content-Length instead of chunked encoding.
+        `idempotency_key` is sent as an Idempotency-Key header so the backend can spot repeats.
+        Transport errors are raised as httpx.HTTPError.
+        """
+        boundary = uuid.uuid4().hex
+        head, tail = multipart_envelope(boundary, data, "images", filename, "image/jpeg")
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        if file_size is not None:
+            headers["Content-Length"] = str(len(head) + file_size + len(tail))
+        return await self._request(
+            "plant_tree", "POST", "/api/plant/tree/", token=token,
+            headers=headers, content=iter_multipart(head, tail, chunks),
+        )
+
+    async def get_me(self, token):
+        cached = self.user_cache.get(token, "get_me")
+        if cached is not None:
+            return cached
+        generation = self.user_cache.generation(token)
         try:
-            response = requests.get(url, headers=headers)
+            response = await self._request("get_me", "GET", "/api/get/me/", token=token)
             response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Get me failed: {e}")
-            return None
+            me = response.json()
+            self.user_cache.set(token, "get_me", me, generation)
+            return me
+        except BACKEND_ERRORS as e:
+            logger.warning(f"Get me failed: {e}", extra={"event": "backend.get_me"})
+            return self.user_cache.get(token, "get_me", stale=True) if backend_down(e) else None
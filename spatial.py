@@ -0,0 +1,111 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def bucket_coordinates(bucket):
+    """(lat, lon) of an ordered bucket, or None if it has no usable location."""
+    lat = bucket.get("latitude")
+    # The backend spells it "lognitude" on plantings
+    lon = bucket.get("longitude", bucket.get("lognitude"))
+    try:
+        return float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+
+class BucketIndex:
+    """Grid index of ordered buckets for nearest-bucket lookups.
+
+    Buckets are hashed into square cells of `cell_size` degrees. nearest() scans
+    rings of cells outward from the query point and stops as soon as no unscanned
+    cell can hold anything closer, so a lookup only touches a few cells no matter
+    how many buckets there are. update() applies a new bucket list as a diff.
+    """
+
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size
+        # (row, col) -> {bucket id: (lat, lon)}
+        self._cells = {}
+        # bucket id (as str, like the ones workers type) -> (cell, lat, lon, bucket)
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size))
+
+    def add(self, bucket):
+        bucket_id = str(bucket["id"])
+        coords = bucket_coordinates(bucket)
+        if coords is None:
+            self.remove(bucket_id)
+            return
+        lat, lon = coords
+        cell = self._cell(lat, lon)
+        old = self._buckets.get(bucket_id)
+        if old is not None and old[0] != cell:
+            self._discard(bucket_id, old[0])
+        self._cells.setdefault(cell, {})[bucket_id] = (lat, lon)
+        self._buckets[bucket_id] = (cell, lat, lon, bucket)
+
+    def remove(self, bucket_id):
+        bucket_id = str(bucket_id)
+        old = self._buckets.pop(bucket_id, None)
+        if old is not None:
+            self._discard(bucket_id, old[0])
+
+    def _discard(self, bucket_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.pop(bucket_id, None)
+            if not members:
+                del self._cells[cell]
+
+    def update(self, buckets):
+        """Makes the index hold exactly `buckets`, touching only the ones that changed."""
+        seen = set()
+        for bucket in buckets:
+            seen.add(str(bucket["id"]))
+            old = self._buckets.get(str(bucket["id"]))
+            if old is None or old[3] != bucket:
+                self.add(bucket)
+        for bucket_id in [b for b in self._buckets if b not in seen]:
+            self.remove(bucket_id)
+
+    def nearest(self, lat, lon, k=5, max_km=5.0):
+        """Up to `k` buckets within `max_km` of the point, closest first, as (distance_km, bucket)."""
+        row, col = self._cell(lat, lon)
+        # Smallest width of a cell in km around here; longitude cells shrink towards the poles
+        cell_km = self.cell_size * KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+        max_ring = int(max_km / cell_km) + 1
+        found = []
+        for ring in range(max_ring + 1):
+            for cell in self._ring(row, col, ring):
+                for bucket_id, (b_lat, b_lon) in self._cells.get(cell, {}).items():
+                    distance = haversine_km(lat, lon, b_lat, b_lon)
+                    if distance <= max_km:
+                        found.append((distance, bucket_id))
+            found.sort()
+            del found[k:]
+            # Everything beyond this ring is at least ring * cell_km away
+            if len(found) == k and found[-1][0] <= ring * cell_km:
+                break
+        return [(distance, self._buckets[bucket_id][3]) for distance, bucket_id in found]
+
+    @staticmethod
+    def _ring(row, col, ring):
+        if ring == 0:
+            yield row, col
+            return
+        for d in range(-ring, ring + 1):
+            yield row - ring, col + d
+            yield row + ring, col + d
+        for d in range(-ring + 1, ring):
+            yield row + d, col - ring
+            yield row + d, col + ring
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# config reads the environment on import, keep everything the tests write out of ./data
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bot-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
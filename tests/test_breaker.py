@@ -0,0 +1,70 @@
+import pytest
+import breaker
+from breaker import CLOSED, HALF_OPEN, OPEN, BackendUnavailable, CircuitBreaker
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breaker.time, "monotonic", lambda: now[0])
+    return now
+
+def test_opens_after_threshold(clock):
+    cb = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        cb.check("login")
+        cb.failure()
+    assert cb.state == CLOSED
+    cb.check("login")
+    cb.failure()
+    assert cb.state == OPEN
+    with pytest.raises(BackendUnavailable):
+        cb.check("login")
+
+def test_success_resets_failure_count(clock):
+    cb = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    cb.failure()
+    cb.success()
+    cb.failure()
+    assert cb.state == CLOSED
+
+def test_half_open_lets_one_probe_through(clock):
+    cb = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    cb.failure()
+    clock[0] += 29
+    with pytest.raises(BackendUnavailable):
+        cb.check("login")
+    clock[0] += 1
+    cb.check("login")
+    assert cb.state == HALF_OPEN
+    with pytest.raises(BackendUnavailable):
+        cb.check("login")
+
+def test_probe_success_closes(clock):
+    cb = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    cb.failure()
+    clock[0] += 30
+    cb.check("login")
+    cb.success()
+    assert cb.state == CLOSED
+    cb.check("login")
+
+def test_probe_failure_reopens(clock):
+    cb = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        cb.failure()
+    clock[0] += 30
+    cb.check("login")
+    cb.failure()
+    assert cb.state == OPEN
+    with pytest.raises(BackendUnavailable):
+        cb.check("login")
+
+def test_lost_probe_is_replaced(clock):
+    cb = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    cb.failure()
+    clock[0] += 30
+    cb.check("login")
+    # The probe never reports back
+    clock[0] += 30
+    cb.check("login")
+    assert cb.state == HALF_OPEN
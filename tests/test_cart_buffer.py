@@ -0,0 +1,99 @@
+import asyncio
+from cart_buffer import CartWriteBuffer
+
+class FakeApi:
+    """add_to_cart takes `delay` seconds and fails for the products in `refuse`."""
+
+    def __init__(self, delay=0, refuse=()):
+        self.delay = delay
+        self.refuse = set(refuse)
+        self.calls = []
+
+    async def add_to_cart(self, token, product_id, count=1):
+        self.calls.append((token, product_id, count))
+        await asyncio.sleep(self.delay)
+        return None if product_id in self.refuse else {"ok": True}
+
+def test_clicks_are_summed_per_product():
+    async def run():
+        api = FakeApi()
+        buffer = CartWriteBuffer(api, window=60)
+        assert buffer.add(1, "t", "7") == 1
+        assert buffer.add(1, "t", "7") == 2
+        assert buffer.add(1, "t2", "8") == 1
+        assert api.calls == []
+        assert await buffer.flush(1)
+        assert sorted(api.calls) == [("t2", "7", 2), ("t2", "8", 1)]
+        await buffer.flush_all()
+    asyncio.run(run())
+
+def test_timer_sends_the_clicks():
+    async def run():
+        api = FakeApi()
+        buffer = CartWriteBuffer(api, window=0.01)
+        buffer.add(1, "t", "7")
+        buffer.add(1, "t", "7")
+        await asyncio.sleep(0.05)
+        assert api.calls == [("t", "7", 2)]
+        # Nothing left to send
+        assert await buffer.flush(1)
+        assert len(api.calls) == 1
+    asyncio.run(run())
+
+def test_flush_before_read_sends_right_away():
+    async def run():
+        api = FakeApi()
+        buffer = CartWriteBuffer(api, window=60)
+        buffer.add(1, "t", "7")
+        buffer.add(2, "u", "7")
+        assert await buffer.flush(1)
+        assert api.calls == [("t", "7", 1)]
+        await buffer.flush_all()
+        assert api.calls == [("t", "7", 1), ("u", "7", 1)]
+    asyncio.run(run())
+
+def test_failed_write_is_reported():
+    async def run():
+        failed = []
+        async def on_failure(product_id, count):
+            failed.append((product_id, count))
+        buffer = CartWriteBuffer(FakeApi(refuse={"7"}), window=60)
+        buffer.add(1, "t", "7", on_failure=on_failure)
+        buffer.add(1, "t", "8", on_failure=on_failure)
+        assert not await buffer.flush(1)
+        assert failed == [("7", 1)]
+    asyncio.run(run())
+
+def test_flush_during_the_timer_send_reports_its_failure():
+    async def run():
+        failed = []
+        async def on_failure(product_id, count):
+            failed.append((product_id, count))
+        buffer = CartWriteBuffer(FakeApi(delay=0.05, refuse={"7"}), window=0.01)
+        buffer.add(1, "t", "7", on_failure=on_failure)
+        # The timer's send is under way when checkout flushes
+        await asyncio.sleep(0.03)
+        assert not await buffer.flush(1)
+        assert failed == [("7", 1)]
+    asyncio.run(run())
+
+def test_flush_during_a_send_also_sends_newer_clicks():
+    async def run():
+        api = FakeApi(delay=0.05)
+        buffer = CartWriteBuffer(api, window=0.01)
+        buffer.add(1, "t", "7")
+        await asyncio.sleep(0.03)
+        buffer.add(1, "t", "8")
+        assert await buffer.flush(1)
+        assert api.calls == [("t", "7", 1), ("t", "8", 1)]
+        await buffer.flush_all()
+    asyncio.run(run())
+
+def test_failing_notification_does_not_reach_the_caller():
+    async def run():
+        async def on_failure(product_id, count):
+            raise RuntimeError("Forbidden: bot can't initiate conversation with a user")
+        buffer = CartWriteBuffer(FakeApi(refuse={"7"}), window=60)
+        buffer.add(1, "t", "7", on_failure=on_failure)
+        assert not await buffer.flush(1)
+    asyncio.run(run())
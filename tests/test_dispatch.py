@@ -0,0 +1,176 @@
+import asyncio
+from prometheus_client import REGISTRY
+from telegram import Update
+from dispatch import PerUserUpdateProcessor, raw_update_key, update_key
+
+def message(update_id, user_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "hi",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+        },
+    }
+
+def update(update_id, user_id):
+    return Update.de_json(message(update_id, user_id), None)
+
+def test_update_key():
+    assert update_key(update(1, 42)) == 42
+    assert raw_update_key(message(1, 42)) == 42
+    assert update_key("not an update") is None
+    assert raw_update_key({"update_id": 1}) is None
+
+def test_same_user_runs_in_order():
+    async def run():
+        processor = PerUserUpdateProcessor(max_running=10, max_pending=100, max_per_user=100)
+        done = []
+        async def handle(n):
+            # Earlier updates take longer, they'd finish last if they ran side by side
+            await asyncio.sleep(0.01 * (5 - n))
+            done.append(n)
+        await asyncio.gather(*[processor.process_update(update(n, 1), handle(n)) for n in range(5)])
+        assert done == [0, 1, 2, 3, 4]
+        assert processor._locks == {}
+    asyncio.run(run())
+
+def test_users_run_in_parallel():
+    async def run():
+        processor = PerUserUpdateProcessor(max_running=10, max_pending=100, max_per_user=100)
+        second_started = asyncio.Event()
+        done = []
+        async def first():
+            # Only finishes if user 2's update runs while this one is still running
+            await asyncio.wait_for(second_started.wait(), 1)
+            done.append(1)
+        async def second():
+            second_started.set()
+            done.append(2)
+        await asyncio.gather(processor.process_update(update(1, 1), first()), processor.process_update(update(2, 2), second()))
+        assert done == [2, 1]
+    asyncio.run(run())
+
+def test_interleaved_users_keep_their_own_order():
+    async def run():
+        processor = PerUserUpdateProcessor(max_running=4, max_pending=100, max_per_user=100)
+        done = {1: [], 2: []}
+        running = peak = 0
+        async def handle(user_id, n):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.001 * ((n * 7) % 5))
+            running -= 1
+            done[user_id].append(n)
+        await asyncio.gather(*[
+            processor.process_update(update(n, n % 2 + 1), handle(n % 2 + 1, n)) for n in range(40)
+        ])
+        assert done[1] == list(range(0, 40, 2))
+        assert done[2] == list(range(1, 40, 2))
+        # One update per user at a time
+        assert peak == 2
+        assert processor.in_flight == processor.received == 0
+    asyncio.run(run())
+
+def test_max_running_caps_concurrency():
+    async def run():
+        processor = PerUserUpdateProcessor(max_running=3, max_pending=100, max_per_user=100)
+        running = peak = 0
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+        await asyncio.gather(*[processor.process_update(update(n, n), handle()) for n in range(10)])
+        assert peak == 3
+    asyncio.run(run())
+
+async def blocked(release, ran):
+    ran.append(True)
+    await release.wait()
+
+def test_user_over_max_per_user_is_dropped():
+    async def run():
+        processor = PerUserUpdateProcessor(max_running=10, max_pending=100, max_per_user=2)
+        release = asyncio.Event()
+        ran = []
+        tasks = [asyncio.create_task(processor.process_update(update(n, 1), blocked(release, ran))) for n in range(2)]
+        await asyncio.sleep(0)
+        await processor.process_update(update(3, 1), blocked(release, ran))
+        # Another user is unaffected
+        tasks.append(asyncio.create_task(processor.process_update(update(4, 2), blocked(release, ran))))
+        await asyncio.sleep(0.01)
+        assert processor.dropped == 1
+        assert len(ran) == 2
+        release.set()
+        await asyncio.gather(*tasks)
+        assert len(ran) == 3
+    asyncio.run(run())
+
+def test_updates_over_max_queued_are_dropped():
+    async def run():
+        processor = PerUserUpdateProcessor(max_running=1, max_pending=100, max_per_user=100, max_queued=3)
+        release = asyncio.Event()
+        ran = []
+        tasks = [asyncio.create_task(processor.process_update(update(n, n), blocked(release, ran))) for n in range(3)]
+        await asyncio.sleep(0.01)
+        assert processor.received == 3
+        assert processor.backlog == 2
+        await processor.process_update(update(9, 9), blocked(release, ran))
+        assert processor.dropped == 1
+        release.set()
+        await asyncio.gather(*tasks)
+        assert len(ran) == 3
+        assert processor.received == 0
+        # Room again
+        await processor.process_update(update(10, 10), blocked(release, ran))
+        assert len(ran) == 4
+    asyncio.run(run())
+
+def test_shed_sees_the_backlog_and_drops():
+    async def run():
+        processor = PerUserUpdateProcessor(max_running=1, max_pending=100, max_per_user=100)
+        seen = []
+        async def shed(update, backlog):
+            seen.append((update.update_id, backlog))
+            return backlog > 2
+        processor.shed = shed
+        release = asyncio.Event()
+        ran = []
+        tasks = []
+        for n in range(4):
+            tasks.append(asyncio.create_task(processor.process_update(update(n, n), blocked(release, ran))))
+            await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(*tasks)
+        # The first update is running by the time the others arrive; each one counts itself
+        assert seen == [(0, 1), (1, 1), (2, 2), (3, 3)]
+        # Shed updates are counted by the hook (UPDATES_REJECTED), not as dropped
+        assert processor.dropped == 0
+        assert len(ran) == 3
+        assert processor.received == 0
+    asyncio.run(run())
+
+def dropped(reason):
+    return REGISTRY.get_sample_value("novda_updates_dropped_total", {"reason": reason}) or 0
+
+def test_drops_are_counted_by_reason():
+    async def run():
+        before = {reason: dropped(reason) for reason in ("user", "backlog")}
+        processor = PerUserUpdateProcessor(max_running=10, max_pending=100, max_per_user=1, max_queued=2)
+        release = asyncio.Event()
+        ran = []
+        tasks = [asyncio.create_task(processor.process_update(update(1, 1), blocked(release, ran)))]
+        await asyncio.sleep(0)
+        await processor.process_update(update(2, 1), blocked(release, ran))
+        tasks.append(asyncio.create_task(processor.process_update(update(3, 2), blocked(release, ran))))
+        await asyncio.sleep(0)
+        await processor.process_update(update(4, 3), blocked(release, ran))
+        release.set()
+        await asyncio.gather(*tasks)
+        assert processor.dropped == 2
+        assert dropped("user") - before["user"] == 1
+        assert dropped("backlog") - before["backlog"] == 1
+    asyncio.run(run())
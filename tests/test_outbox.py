@@ -0,0 +1,229 @@
+import asyncio
+import os
+import time
+import httpx
+import pytest
+import outbox
+from outbox import PlantingOutbox
+
+DATA = {"bucket": "B-1", "latitude": "41.3", "lognitude": "69.2"}
+
+class FakeApi:
+    """Answers upload_planting with the given responses (or raises them) in turn."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.uploads = []
+
+    async def iter_file(self, path):
+        with open(path, "rb") as f:
+            yield f.read()
+
+    async def upload_planting(self, token, data, chunks, size, idempotency_key=None):
+        photo = b"".join([chunk async for chunk in chunks])
+        self.uploads.append((token, data, photo, idempotency_key))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+async def photo(content=b"photo"):
+    yield content
+
+def row(box, planting_id):
+    return box._db.execute("SELECT * FROM plantings WHERE id = ?", (planting_id,)).fetchone()
+
+def fingerprints(box):
+    return dict(box._db.execute("SELECT key, status FROM fingerprints").fetchall())
+
+@pytest.fixture
+def make_outbox(tmp_path):
+    boxes = []
+    def make(*responses, token_lookup=None):
+        box = PlantingOutbox(FakeApi(*responses), str(tmp_path), workers=1, token_lookup=token_lookup)
+        boxes.append(box)
+        return box
+    yield make
+    for box in boxes:
+        box.close()
+
+# State transitions
+
+def test_add_queues_the_submission(make_outbox):
+    async def run():
+        box = make_outbox()
+        status, planting_id = await box.add(1, 10, "t", DATA, photo())
+        assert status == "queued"
+        saved = row(box, planting_id)
+        assert saved["status"] == "pending" and saved["attempts"] == 0
+        with open(saved["photo_path"], "rb") as f:
+            assert f.read() == b"photo"
+        assert box.pending_count() == 1
+    asyncio.run(run())
+
+def test_uploaded_submission_is_removed(make_outbox):
+    async def run():
+        box = make_outbox(httpx.Response(201, json={"id": 5}))
+        _, planting_id = await box.add(1, 10, "t", DATA, photo())
+        saved = row(box, planting_id)
+        path = saved["photo_path"]
+        assert await box._upload(saved) == ("uploaded", {"id": 5})
+        assert row(box, planting_id) is None
+        assert not os.path.exists(path)
+        assert box.pending_count() == 0
+        assert box.api.uploads == [("t", DATA, b"photo", saved["idempotency_key"])]
+    asyncio.run(run())
+
+def test_rejected_submission_fails_and_drops_its_photo(make_outbox):
+    async def run():
+        box = make_outbox(httpx.Response(400, text="no such bucket"))
+        _, planting_id = await box.add(1, 10, "t", DATA, photo())
+        path = row(box, planting_id)["photo_path"]
+        assert await box._upload(row(box, planting_id)) == ("rejected", "no such bucket")
+        failed = row(box, planting_id)
+        assert failed["status"] == "failed" and failed["last_error"] == "no such bucket"
+        assert not os.path.exists(path)
+        assert box.pending_count() == 0
+    asyncio.run(run())
+
+@pytest.mark.parametrize("outcome", [httpx.Response(503), httpx.Response(429), httpx.ConnectError("down")])
+def test_temporary_failure_is_retried(make_outbox, outcome):
+    async def run():
+        box = make_outbox(outcome)
+        _, planting_id = await box.add(1, 10, "t", DATA, photo())
+        assert await box._upload(row(box, planting_id)) == ("queued", planting_id)
+        retried = row(box, planting_id)
+        assert retried["status"] == "pending" and retried["attempts"] == 1
+        assert retried["next_attempt_at"] > time.time()
+        assert os.path.exists(retried["photo_path"])
+        assert box.pending_count() == 1
+    asyncio.run(run())
+
+def test_refused_token_waits_for_the_next_login(make_outbox):
+    async def run():
+        tokens = {1: "old"}
+        box = make_outbox(httpx.Response(401), httpx.Response(201, json={}), token_lookup=tokens.get)
+        _, planting_id = await box.add(1, 10, "old", DATA, photo())
+        assert await box._upload(row(box, planting_id)) == ("queued", planting_id)
+        assert row(box, planting_id)["next_attempt_at"] > time.time()
+
+        tokens[1] = "new"
+        box.retry_user(1)
+        assert row(box, planting_id)["next_attempt_at"] <= time.time()
+        assert await box._upload(row(box, planting_id)) == ("uploaded", {})
+        assert [upload[0] for upload in box.api.uploads] == ["old", "new"]
+    asyncio.run(run())
+
+def test_refused_token_is_given_up_after_auth_wait(make_outbox, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_AUTH_WAIT", 0)
+    async def run():
+        box = make_outbox(httpx.Response(403, text="forbidden"))
+        _, planting_id = await box.add(1, 10, "t", DATA, photo())
+        assert (await box._upload(row(box, planting_id)))[0] == "rejected"
+        assert row(box, planting_id)["status"] == "failed"
+    asyncio.run(run())
+
+def test_worker_survives_unexpected_errors(make_outbox):
+    async def run():
+        box = make_outbox(RuntimeError("boom"))
+        _, planting_id = await box.add(1, 10, "t", DATA, photo())
+        box._queue = asyncio.Queue()
+        worker = asyncio.create_task(box._work())
+        box._queue.put_nowait(row(box, planting_id))
+        await box._queue.join()
+        assert not worker.done()
+        retried = row(box, planting_id)
+        assert retried["attempts"] == 1 and retried["last_error"] == "RuntimeError: boom"
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+    asyncio.run(run())
+
+def test_workers_upload_queued_submissions(make_outbox):
+    async def run():
+        box = make_outbox(httpx.Response(201, json={}))
+        done = asyncio.Event()
+        async def on_done(record, result):
+            done.set()
+        box.on_done = on_done
+        box.start()
+        _, planting_id = await box.add(1, 10, "t", DATA, photo())
+        await asyncio.wait_for(done.wait(), 5)
+        await box.stop()
+        assert row(box, planting_id) is None
+    asyncio.run(run())
+
+# Fingerprints
+
+def test_same_photo_for_the_same_place_is_a_duplicate(make_outbox):
+    async def run():
+        box = make_outbox()
+        _, first = await box.add(1, 10, "t", DATA, photo())
+        assert await box.add(1, 10, "t", DATA, photo()) == ("duplicate", first)
+        assert box.pending_count() == 1
+        assert len(os.listdir(box._photo_dir)) == 1
+    asyncio.run(run())
+
+def test_same_photo_for_another_place_is_not_a_duplicate(make_outbox):
+    async def run():
+        box = make_outbox()
+        await box.add(1, 10, "t", DATA, photo())
+        assert (await box.add(1, 10, "t", {**DATA, "bucket": "B-2"}, photo()))[0] == "queued"
+        assert (await box.add(1, 10, "t", {**DATA, "latitude": "41.4"}, photo()))[0] == "queued"
+        assert (await box.add(1, 10, "t", DATA, photo(b"other")))[0] == "queued"
+    asyncio.run(run())
+
+def test_known_file_is_not_downloaded(make_outbox):
+    async def run():
+        box = make_outbox()
+        _, first = await box.add(1, 10, "t", DATA, photo(), file_unique_id="F1")
+        downloaded = []
+        async def chunks():
+            downloaded.append(True)
+            yield b"photo"
+        assert await box.add(1, 10, "t", DATA, chunks(), file_unique_id="F1") == ("duplicate", first)
+        assert downloaded == []
+    asyncio.run(run())
+
+def test_uploaded_submission_stays_a_duplicate_for_the_ttl(make_outbox, monkeypatch):
+    async def run():
+        box = make_outbox(httpx.Response(201, json={}))
+        _, first = await box.add(1, 10, "t", DATA, photo(), file_unique_id="F1")
+        await box._upload(row(box, first))
+        assert set(fingerprints(box).values()) == {"uploaded"}
+        assert await box.add(1, 10, "t", DATA, photo(), file_unique_id="F1") == ("duplicate", first)
+
+        monkeypatch.setattr(outbox, "OUTBOX_DEDUP_TTL", 0)
+        # Expired, even before the purge gets to it
+        assert (await box.add(1, 10, "t", DATA, photo(), file_unique_id="F1"))[0] == "queued"
+    asyncio.run(run())
+
+def test_purge_drops_only_expired_uploaded_fingerprints(make_outbox, monkeypatch):
+    async def run():
+        box = make_outbox(httpx.Response(201, json={}))
+        _, uploaded = await box.add(1, 10, "t", DATA, photo())
+        await box._upload(row(box, uploaded))
+        await box.add(1, 10, "t", DATA, photo(b"other"))
+        monkeypatch.setattr(outbox, "OUTBOX_DEDUP_TTL", 0)
+        box._purge_fingerprints()
+        assert list(fingerprints(box).values()) == ["pending"]
+    asyncio.run(run())
+
+def test_rejected_submission_can_be_sent_again(make_outbox):
+    async def run():
+        box = make_outbox(httpx.Response(400, text="bad"))
+        _, first = await box.add(1, 10, "t", DATA, photo(), file_unique_id="F1")
+        await box._upload(row(box, first))
+        assert fingerprints(box) == {}
+        status, second = await box.add(1, 10, "t", DATA, photo(), file_unique_id="F1")
+        assert status == "queued" and second != first
+    asyncio.run(run())
+
+def test_fingerprints_survive_a_restart(make_outbox):
+    async def run():
+        box = make_outbox()
+        _, first = await box.add(1, 10, "t", DATA, photo())
+        box.close()
+        box = make_outbox()
+        assert box.pending_count() == 1
+        assert await box.add(1, 10, "t", DATA, photo()) == ("duplicate", first)
+    asyncio.run(run())
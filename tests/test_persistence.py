@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from persistence import SqlitePersistence
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "state.sqlite3")
+
+def rows(persistence):
+    return sorted(persistence._db.execute("SELECT user_id, key, value FROM user_data"))
+
+def test_only_changed_keys_are_written(path):
+    async def run():
+        p = SqlitePersistence(path)
+        await p.update_user_data(1, {"lang": "en", "cart": [1, 2]})
+        await p.flush()
+        await p.update_user_data(1, {"lang": "en", "cart": [1, 2, 3]})
+        assert p._upserts == {(1, "cart"): "[1, 2, 3]"}
+        assert p._deletes == set()
+        await p.flush()
+        await p.update_user_data(1, {"lang": "en", "cart": [1, 2, 3]})
+        assert p._upserts == {} and p._deletes == set()
+        assert rows(p) == [(1, "cart", "[1, 2, 3]"), (1, "lang", '"en"')]
+        p.close()
+    asyncio.run(run())
+
+def test_removed_keys_are_deleted(path):
+    async def run():
+        p = SqlitePersistence(path)
+        await p.update_user_data(1, {"lang": "en", "bucket": "B-1"})
+        await p.flush()
+        await p.update_user_data(1, {"lang": "en"})
+        assert p._upserts == {}
+        assert p._deletes == {(1, "bucket")}
+        await p.flush()
+        assert rows(p) == [(1, "lang", '"en"')]
+        await p.drop_user_data(1)
+        await p.flush()
+        assert rows(p) == []
+        p.close()
+    asyncio.run(run())
+
+def test_key_set_again_before_commit(path):
+    async def run():
+        p = SqlitePersistence(path)
+        await p.update_user_data(1, {"bucket": "B-1"})
+        await p.flush()
+        await p.update_user_data(1, {})
+        await p.update_user_data(1, {"bucket": "B-2"})
+        assert p._deletes == set()
+        await p.flush()
+        assert rows(p) == [(1, "bucket", '"B-2"')]
+        p.close()
+    asyncio.run(run())
+
+def test_passwords_are_never_stored(path):
+    async def run():
+        p = SqlitePersistence(path)
+        await p.update_user_data(1, {"login_username": "ann", "login_password": "secret", "reg_password": "x"})
+        await p.flush()
+        assert rows(p) == [(1, "login_username", '"ann"')]
+        p.close()
+    asyncio.run(run())
+
+def test_passwords_left_by_older_versions_are_removed(path):
+    async def run():
+        p = SqlitePersistence(path)
+        with p._db:
+            p._db.execute("INSERT INTO user_data VALUES (1, 'reg_password', '\"secret\"')")
+        p.close()
+        p = SqlitePersistence(path)
+        assert rows(p) == []
+        assert await p.get_user_data() == {}
+        p.close()
+    asyncio.run(run())
+
+def test_state_survives_restart(path):
+    async def run():
+        p = SqlitePersistence(path)
+        await p.update_user_data(1, {"cart": {"7": 2}})
+        await p.update_conversation("plant", (10, 1), 3)
+        await p.update_conversation("login", (10, 1), 1)
+        await p.flush()
+        await p.update_conversation("login", (10, 1), None)
+        p.close()
+
+        p = SqlitePersistence(path)
+        assert await p.get_user_data() == {1: {"cart": {"7": 2}}}
+        assert await p.get_conversations("plant") == {(10, 1): 3}
+        assert await p.get_conversations("login") == {}
+        # Nothing changed since loading, nothing to write
+        await p.update_user_data(1, {"cart": {"7": 2}})
+        assert p._upserts == {}
+        p.close()
+    asyncio.run(run())
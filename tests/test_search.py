@@ -0,0 +1,46 @@
+from search import CatalogSearch
+
+def product(product_id, name, desc=""):
+    return {"id": product_id, "price": "10", "tree": {"name_en": name, "desc_en": desc}}
+
+CATALOG = [
+    product(1, "Apple tree", "Sweet fruit"),
+    product(2, "Oak", "Shade tree, grows slowly"),
+    product(3, "Apricot", "Fruit tree"),
+]
+
+def test_every_query_word_must_match_a_prefix():
+    index = CatalogSearch()
+    index.update(CATALOG)
+    assert index.search("ap") == [1, 3]
+    assert index.search("fruit ap") == [1, 3]
+    assert index.search("oak fruit") == []
+    assert index.search("") == [1, 2, 3]
+
+def test_name_matches_rank_before_descriptions():
+    index = CatalogSearch()
+    index.update(CATALOG)
+    assert index.search("tree") == [1, 2, 3]
+    assert index.search("tr") == [1, 2, 3]
+    index.update([CATALOG[1], CATALOG[2], CATALOG[0]])
+    # Apple tree names it, the others only describe it; ties follow the catalog order
+    assert index.search("tree") == [1, 2, 3]
+    assert index.search("fruit") == [3, 1]
+
+def test_update_reindexes_changed_products_and_clears_answers():
+    index = CatalogSearch()
+    index.update(CATALOG)
+    assert [r.id for r in index.answer("en", "oak")] == ["2"]
+    index.update([product(2, "Maple"), CATALOG[2]])
+    assert index.answer("en", "oak") == []
+    assert index.search("maple") == [2]
+    assert index.search("apple") == []
+    assert len(index) == 2
+
+def test_pages():
+    index = CatalogSearch(page_size=2)
+    index.update(CATALOG)
+    results, next_offset = index.page("en", "", 0)
+    assert [r.id for r in results] == ["1", "2"] and next_offset == "2"
+    results, next_offset = index.page("en", "", 2)
+    assert [r.id for r in results] == ["3"] and next_offset == ""
@@ -0,0 +1,124 @@
+import asyncio
+import httpx
+import pytest
+from services import ApiService, UserCache
+
+CART_PATH = "/api/get/my/trees/"
+ITEM = {"product": {"id": 1, "price": "10"}, "count": 1}
+
+class Backend:
+    """Holds every GET until the test releases it; POST /api/addToCart/ adds ITEM to the cart."""
+
+    def __init__(self):
+        self.cart = []
+        # One event per GET received, set to let it answer
+        self.gets = []
+
+    async def handle(self, request):
+        if request.method == "POST":
+            self.cart = [ITEM]
+            return httpx.Response(200, json={"ok": True})
+        # The answer reflects the cart as it was when the request arrived
+        cart = list(self.cart)
+        release = asyncio.Event()
+        self.gets.append(release)
+        await release.wait()
+        return httpx.Response(200, json=cart)
+
+async def gets_reach(backend, n):
+    async def wait():
+        while len(backend.gets) < n:
+            await asyncio.sleep(0)
+    await asyncio.wait_for(wait(), 1)
+
+@pytest.fixture
+def backend():
+    return Backend()
+
+def api_for(backend):
+    return ApiService(transport=httpx.MockTransport(backend.handle))
+
+def test_concurrent_identical_gets_share_one_request(backend):
+    async def run():
+        api = api_for(backend)
+        reads = [asyncio.create_task(api.get_my_trees("tok")) for _ in range(3)]
+        await gets_reach(backend, 1)
+        await asyncio.sleep(0.01)
+        assert len(backend.gets) == 1
+        backend.gets[0].set()
+        assert await asyncio.gather(*reads) == [[], [], []]
+        assert api._inflight == {}
+        await api.close()
+    asyncio.run(run())
+
+def test_other_users_do_not_share_a_get(backend):
+    async def run():
+        api = api_for(backend)
+        reads = [asyncio.create_task(api.get_my_trees(token)) for token in ("tok", "other")]
+        await gets_reach(backend, 2)
+        for release in backend.gets:
+            release.set()
+        await asyncio.gather(*reads)
+        await api.close()
+    asyncio.run(run())
+
+def test_get_in_flight_during_a_write_is_neither_cached_nor_shared(backend):
+    async def run():
+        api = api_for(backend)
+        before = asyncio.create_task(api.get_my_trees("tok"))
+        await gets_reach(backend, 1)
+
+        assert await api.add_to_cart("tok", 1)
+        # Must not join the GET that started before the write
+        after = asyncio.create_task(api.get_my_trees("tok"))
+        await gets_reach(backend, 2)
+        # But a later identical read joins the new one
+        joined = asyncio.create_task(api.get_my_trees("tok"))
+        await asyncio.sleep(0.01)
+        assert len(backend.gets) == 2
+
+        backend.gets[0].set()
+        assert await before == []
+        # The old request finishing doesn't unregister the new one
+        assert (CART_PATH, "tok") in api._inflight
+        assert api.user_cache.get("tok", "get_my_trees") is None
+
+        backend.gets[1].set()
+        assert await after == [ITEM]
+        assert await joined == [ITEM]
+        assert await api.get_my_trees("tok") == [ITEM]
+        assert len(backend.gets) == 2
+        await api.close()
+    asyncio.run(run())
+
+def test_read_finishing_after_a_write_is_not_cached():
+    cache = UserCache(ttl=60, size=10)
+    generation = cache.generation("tok")
+    cache.invalidate("tok", "get_my_trees")
+    cache.set("tok", "get_my_trees", ["stale"], generation)
+    assert cache.get("tok", "get_my_trees") is None
+    cache.set("tok", "get_my_trees", ["fresh"], cache.generation("tok"))
+    assert cache.get("tok", "get_my_trees") == ["fresh"]
+
+def test_invalidate_drops_only_the_named_reads():
+    cache = UserCache(ttl=60, size=10)
+    cache.set("tok", "get_my_trees", [1], 0)
+    cache.set("tok", "get_profile", {"id": 1}, 0)
+    cache.invalidate("tok", "get_my_trees")
+    assert cache.get("tok", "get_my_trees") is None
+    assert cache.get("tok", "get_profile") == {"id": 1}
+    cache.invalidate("tok")
+    assert cache.get("tok", "get_profile") is None
+
+def test_expired_entries_are_kept_for_stale_reads(monkeypatch):
+    import services
+    now = [100.0]
+    monkeypatch.setattr(services.time, "monotonic", lambda: now[0])
+    cache = UserCache(ttl=60, size=1)
+    cache.set("tok", "get_my_trees", [1], 0)
+    now[0] += 60
+    assert cache.get("tok", "get_my_trees") is None
+    assert cache.get("tok", "get_my_trees", stale=True) == [1]
+    # Least recently used user is evicted past `size`
+    cache.set("other", "get_my_trees", [2], 0)
+    assert cache.get("tok", "get_my_trees", stale=True) is None
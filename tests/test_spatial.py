@@ -0,0 +1,38 @@
+import random
+from spatial import BucketIndex, bucket_coordinates, haversine_km
+
+def brute_force(buckets, lat, lon, k, max_km):
+    found = sorted(
+        (haversine_km(lat, lon, b["latitude"], b["longitude"]), str(b["id"])) for b in buckets
+    )
+    return [(d, bucket_id) for d, bucket_id in found if d <= max_km][:k]
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(7)
+    buckets = [
+        {"id": i, "latitude": 41.3 + rng.uniform(-0.2, 0.2), "longitude": 69.2 + rng.uniform(-0.2, 0.2)}
+        for i in range(3000)
+    ]
+    index = BucketIndex(cell_size=0.01)
+    index.update(buckets)
+    for _ in range(200):
+        lat, lon = 41.3 + rng.uniform(-0.25, 0.25), 69.2 + rng.uniform(-0.25, 0.25)
+        k, max_km = rng.choice([1, 5, 20]), rng.choice([0.5, 2.0, 10.0])
+        got = [(d, str(b["id"])) for d, b in index.nearest(lat, lon, k, max_km)]
+        assert got == brute_force(buckets, lat, lon, k, max_km)
+
+def test_update_applies_the_diff():
+    index = BucketIndex()
+    index.update([{"id": 1, "latitude": 41.3, "longitude": 69.2}, {"id": 2, "latitude": 41.31, "longitude": 69.2}])
+    index.update([{"id": 2, "latitude": 42.0, "longitude": 70.0}, {"id": 3, "latitude": 41.3, "longitude": 69.2}])
+    assert len(index) == 2
+    assert [b["id"] for _, b in index.nearest(41.3, 69.2, k=5, max_km=5)] == [3]
+    assert [b["id"] for _, b in index.nearest(42.0, 70.0, k=5, max_km=5)] == [2]
+    index.remove(3)
+    assert index.nearest(41.3, 69.2) == []
+
+def test_buckets_without_a_location_are_left_out():
+    index = BucketIndex()
+    index.update([{"id": 1, "latitude": None, "longitude": 69.2}, {"id": 2, "latitude": "41.3", "lognitude": "69.2"}])
+    assert len(index) == 1
+    assert bucket_coordinates({"latitude": "x", "longitude": 1}) is None
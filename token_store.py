@@ -0,0 +1,175 @@
+import asyncio
+import base64
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from config import TOKEN_STORE, TOKEN_DB_PATH, TOKEN_CACHE_SIZE, TOKEN_FLUSH_BATCH
+
+def jwt_expiry(token):
+    """Returns the `exp` claim of a JWT access token, or None if it can't be read.
+
+    The signature is not checked here, the backend does that on every call.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+def _expired(exp):
+    return exp is not None and exp <= time.time()
+
+class TokenStore:
+    """Maps Telegram user ids to backend access tokens."""
+
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def set(self, user_id, token):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    async def flush_periodically(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+class MemoryTokenStore(TokenStore):
+    """Process-local store, tokens are lost on restart."""
+
+    def __init__(self):
+        self._tokens = {}
+
+    def get(self, user_id):
+        entry = self._tokens.get(user_id)
+        if entry is None:
+            return None
+        token, exp = entry
+        if _expired(exp):
+            del self._tokens[user_id]
+            return None
+        return token
+
+    def set(self, user_id, token):
+        self._tokens[user_id] = (token, jwt_expiry(token))
+
+    def delete(self, user_id):
+        self._tokens.pop(user_id, None)
+
+class SqliteTokenStore(TokenStore):
+    """SQLite-backed store behind an in-memory LRU.
+
+    Reads are served from the LRU, which also remembers users without a token,
+    so check_auth doesn't touch the disk for active users. Writes go to the LRU
+    right away and are written to SQLite in batches by flush().
+    """
+
+    def __init__(self, path, cache_size=10000, flush_batch=100):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            "user_id INTEGER PRIMARY KEY, token TEXT NOT NULL, expires_at REAL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tokens_expires_at ON tokens (expires_at)")
+        self._db.commit()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._flush_batch = flush_batch
+        # user_id -> (token, exp), or None for a pending delete
+        self._pending = {}
+        self._purge_expired()
+        self._warm()
+
+    def _purge_expired(self):
+        self._db.execute("DELETE FROM tokens WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        self._db.commit()
+
+    def _warm(self):
+        # Load the most recently used sessions so the first update after a restart is a cache hit
+        rows = self._db.execute(
+            "SELECT user_id, token, expires_at FROM "
+            "(SELECT * FROM tokens ORDER BY updated_at DESC LIMIT ?) ORDER BY updated_at ASC",
+            (self._cache_size,),
+        ).fetchall()
+        for user_id, token, exp in rows:
+            self._cache[user_id] = (token, exp)
+
+    def _remember(self, user_id, entry):
+        self._cache[user_id] = entry
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def get(self, user_id):
+        if user_id in self._cache:
+            self._cache.move_to_end(user_id)
+            entry = self._cache[user_id]
+        elif user_id in self._pending:
+            # Evicted from the LRU before its write reached the database
+            entry = self._pending[user_id]
+            self._remember(user_id, entry)
+        else:
+            row = self._db.execute("SELECT token, expires_at FROM tokens WHERE user_id = ?", (user_id,)).fetchone()
+            entry = tuple(row) if row else None
+            self._remember(user_id, entry)
+        if entry is None:
+            return None
+        token, exp = entry
+        if _expired(exp):
+            self.delete(user_id)
+            return None
+        return token
+
+    def set(self, user_id, token):
+        entry = (token, jwt_expiry(token))
+        self._remember(user_id, entry)
+        self._stage(user_id, entry)
+
+    def delete(self, user_id):
+        self._remember(user_id, None)
+        self._stage(user_id, None)
+
+    def _stage(self, user_id, entry):
+        self._pending[user_id] = entry
+        if len(self._pending) >= self._flush_batch:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        now = time.time()
+        upserts = [(user_id, e[0], e[1], now) for user_id, e in pending.items() if e is not None]
+        deletes = [(user_id,) for user_id, e in pending.items() if e is None]
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO tokens (user_id, token, expires_at, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET token = excluded.token, "
+                "expires_at = excluded.expires_at, updated_at = excluded.updated_at",
+                upserts,
+            )
+            self._db.executemany("DELETE FROM tokens WHERE user_id = ?", deletes)
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+def create_token_store():
+    if TOKEN_STORE == "memory":
+        return MemoryTokenStore()
+    return SqliteTokenStore(TOKEN_DB_PATH, TOKEN_CACHE_SIZE, TOKEN_FLUSH_BATCH)